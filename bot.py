@@ -1,56 +1,94 @@
 import logging
 import os
 import asyncio
+import html
+import queue
+import signal
+import sys
+import time
+from bisect import bisect_right
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
+from functools import lru_cache, partial
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Callable, Optional, Dict, Any, List, Set, Tuple
+from sqlalchemy import case, func, insert, select, update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, ChatMember
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, TypeHandler, filters
 from telegram.constants import ParseMode
-from telegram.error import TelegramError
+from telegram.error import BadRequest, Forbidden, TelegramError
+from telegram.request import HTTPXRequest
 
 # Импортируем настройки и утилиты
 from config.settings import *
 from utils.database import Database
-from utils.cron_server import CronServer
-from utils.helpers import format_currency
-from models.user import User, WithdrawalRequest, Investment
+from utils.helpers import format_currency, format_now
+from utils.rate_limiter import AIMDRateLimiter, send_limiter
+from utils.cache import TTLCache
+from models.user import User, Referral, WithdrawalRequest, Investment
 
 # Настройка логгера
 logger = logging.getLogger(__name__)
 
 # Импортируем обработчики
 from handlers.user import check_channel_subscription, show_channel_check, show_balance
-from handlers.admin import handle_admin_command, handle_admin_message
+from handlers.admin import ADMIN_INPUT_PROMPTS, handle_admin_command, handle_admin_message, prompt_admin_input
 from handlers.withdraw import (
     handle_withdraw_request, 
     notify_admins_withdrawal, 
-    handle_payment_details
+    process_withdrawal
 )
 from handlers.investments import show_investments, handle_investment_request
 from handlers.referral import show_referral_program, handle_referral_bonus
+from services.analytics import schedule_analytics
+from services.notifications import notify_admins
 
 class BotLogger:
-    """Настройка логирования для бота"""
+    """Настройка логирования для бота
+
+    Обработчики пишут в очередь, а запись в файл и консоль выполняет
+    QueueListener в отдельном потоке, чтобы диск не блокировал цикл событий.
+    """
+    
+    listener: Optional[QueueListener] = None
     
     @staticmethod
     def setup_logging():
         """Настройка системы логирования"""
-        logging.basicConfig(
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            level=logging.INFO,
-            handlers=[
-                logging.FileHandler('bot.log', encoding='utf-8'),
-                logging.StreamHandler()
-            ]
-        )
+        if BotLogger.listener is None:
+            formatter = logging.Formatter(
+                '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                datefmt='%d.%m.%Y %H:%M:%S'
+            )
+            # Ротация не дает логу расти без ограничений
+            file_handler = RotatingFileHandler('bot.log', maxBytes=10_000_000, backupCount=5, encoding='utf-8')
+            stream_handler = logging.StreamHandler()
+            for handler in (file_handler, stream_handler):
+                handler.setFormatter(formatter)
+            
+            # SimpleQueue (реализован на C) дешевле Queue: без task_done и ограничения размера
+            log_queue = queue.SimpleQueue()
+            BotLogger.listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+            BotLogger.listener.start()
+            logging.basicConfig(level=logging.INFO, handlers=[QueueHandler(log_queue)])
         return logging.getLogger(__name__)
+    
+    @staticmethod
+    def shutdown_logging() -> None:
+        """Дописать оставшиеся записи и остановить поток логирования"""
+        if BotLogger.listener is not None:
+            BotLogger.listener.stop()
+            BotLogger.listener = None
 
 class UserService:
     """Сервис для работы с пользователями"""
     
-    def __init__(self, database: Database):
+    def __init__(self, database: Database, on_change: Optional[Callable[[], None]] = None):
         self.db = database
         self.logger = logging.getLogger(__name__)
+        # Вызывается после изменения данных, от которых зависит статистика
+        self.on_change = on_change
     
     def is_admin(self, user_id: int) -> bool:
         """Проверка является ли пользователь админом"""
@@ -59,31 +97,64 @@ class UserService:
     def is_blocked(self, user_id: int) -> bool:
         """Проверка заблокирован ли пользователь"""
         user = self.db.get_user(user_id)
-        return user and user.is_blocked if user else False
+        return bool(user and user.is_blocked)
     
     async def create_user(self, user_id: int, ref_id: Optional[int] = None) -> User:
         """Создание нового пользователя с реферальной системой"""
         try:
-            # Создаем нового пользователя
-            user = self.db.create_user(user_id)
+            # Запись выполняется в пуле потоков БД, в цикле событий остается только чтение
+            referrer_pk = await self.db.run_in_session(self._create_user_sync, user_id, ref_id)
+            if self.on_change:
+                self.on_change()
+            if referrer_pk:
+                # Баланс и рефералы реферера изменились в другой сессии
+                self.db.expire(User, referrer_pk)
+                self.logger.info("User %s joined via referral link %s", user_id, ref_id)
             
-            # Обработка реферальной ссылки
-            if ref_id and ref_id != user_id:
-                referrer = self.db.get_user(ref_id)
-                if referrer and not self.db.get_referral(ref_id, user_id):
-                    # Создаем реферальную связь
-                    self.db.create_referral(ref_id, user_id)
-                    # Начисляем бонус рефереру
-                    referrer.balance += REFERRAL_BONUS
-                    referrer.total_earned += REFERRAL_BONUS
-                    self.db.session.commit()
-                    self.logger.info(f"User {user_id} joined via referral link {ref_id}")
-            
-            return user
+            return self.db.get_user(user_id)
             
         except Exception as e:
-            self.logger.error(f"Error creating user {user_id}: {e}")
+            self.logger.error("Error creating user %s: %s", user_id, e)
             raise
+    
+    @staticmethod
+    def _create_user_sync(session: Session, user_id: int, ref_id: Optional[int]) -> Optional[int]:
+        """Создание пользователя и начисление бонуса рефереру в одной транзакции
+
+        Возвращает первичный ключ реферера, если бонус начислен.
+        """
+        # Создаем нового пользователя
+        user = User(user_id=user_id)
+        session.add(user)
+        session.flush()
+        
+        # Обработка реферальной ссылки
+        if not ref_id or ref_id == user_id:
+            return None
+        
+        referrer_pk = session.scalar(select(User.id).where(User.user_id == ref_id))
+        if referrer_pk is None:
+            return None
+        
+        # Отдельная проверка существующей связи не нужна - пользователь только что создан
+        # в этой же транзакции
+        session.execute(
+            insert(Referral).values(referrer_id=referrer_pk, referred_id=user.id, bonus_paid=0)
+        )
+        
+        # Начисляем бонус рефереру одним атомарным UPDATE
+        session.execute(
+            update(User)
+            .where(User.id == referrer_pk)
+            .values(
+                balance=User.balance + REFERRAL_BONUS,
+                total_earned=User.total_earned + REFERRAL_BONUS
+            )
+        )
+        return referrer_pk
+
+# Интервал между ежедневными бонусами
+_DAILY = timedelta(days=1)
 
 class BonusService:
     """Сервис для работы с бонусами"""
@@ -92,41 +163,51 @@ class BonusService:
         self.db = database
         self.logger = logging.getLogger(__name__)
     
-    def can_claim_daily_bonus(self, user: User) -> tuple[bool, Optional[timedelta]]:
+    def can_claim_daily_bonus(self, user: User, now: Optional[datetime] = None) -> tuple[bool, Optional[timedelta]]:
         """Проверка возможности получения ежедневного бонуса"""
-        now = datetime.now()
+        now = now or datetime.now()
         time_since_last = now - user.last_bonus
         
-        if time_since_last >= timedelta(days=1):
+        if time_since_last >= _DAILY:
             return True, None
         
-        next_bonus_time = user.last_bonus + timedelta(days=1) - now
+        next_bonus_time = user.last_bonus + _DAILY - now
         return False, next_bonus_time
     
-    def claim_daily_bonus(self, user: User) -> bool:
+    async def claim_daily_bonus(self, user: User, now: Optional[datetime] = None) -> bool:
         """Начисление ежедневного бонуса"""
         try:
-            can_claim, _ = self.can_claim_daily_bonus(user)
-            if not can_claim:
-                return False
-            
-            user.balance += DAILY_BONUS
-            user.total_earned += DAILY_BONUS
-            user.last_bonus = datetime.now()
-            self.db.session.commit()
-            
-            self.logger.info(f"Daily bonus claimed by user {user.user_id}")
-            return True
+            claimed = await self.db.run_in_session(self._claim_daily_bonus_sync, user.id, now or datetime.now())
+            if claimed:
+                self.db.expire(User, user.id)
+                self.logger.info("Daily bonus claimed by user %s", user.user_id)
+            return claimed
         except Exception as e:
-            self.logger.error(f"Error claiming daily bonus for user {user.user_id}: {e}")
+            self.logger.error("Error claiming daily bonus for user %s: %s", user.user_id, e)
             return False
+    
+    @staticmethod
+    def _claim_daily_bonus_sync(session: Session, user_pk: int, now: datetime) -> bool:
+        """Атомарное начисление: условие на last_bonus не даст получить бонус дважды"""
+        result = session.execute(
+            update(User)
+            .where(User.id == user_pk, User.last_bonus <= now - _DAILY)
+            .values(
+                balance=User.balance + DAILY_BONUS,
+                total_earned=User.total_earned + DAILY_BONUS,
+                last_bonus=now
+            )
+        )
+        return result.rowcount == 1
 
 class WithdrawalService:
     """Сервис для работы с выводом средств"""
     
-    def __init__(self, database: Database):
+    def __init__(self, database: Database, on_change: Optional[Callable[[], None]] = None):
         self.db = database
         self.logger = logging.getLogger(__name__)
+        # Вызывается после изменения данных, от которых зависит статистика
+        self.on_change = on_change
     
     def validate_withdrawal(self, user: User, amount: int) -> Dict[str, Any]:
         """Валидация запроса на вывод"""
@@ -144,60 +225,170 @@ class WithdrawalService:
         
         return {'valid': True}
     
-    def create_withdrawal_request(self, user: User, amount: int, method: str, details: str) -> Optional[WithdrawalRequest]:
+    async def create_withdrawal_request(self, user: User, amount: int, method: str, details: str) -> Optional[WithdrawalRequest]:
         """Создание заявки на вывод"""
         try:
-            validation = self.validate_withdrawal(user, amount)
-            if not validation['valid']:
-                return None
-            
-            # Создаем заявку
-            withdrawal = WithdrawalRequest(
-                user_id=user.id,
-                amount=amount,
-                method=method,
-                details=details,
-                date=datetime.now(),
-                status='pending'
+            withdrawal = await self.db.run_in_session(
+                self._create_withdrawal_request_sync, user.id, amount, method, details
             )
-            
-            # Списываем средства с баланса
-            user.balance -= amount
-            
-            self.db.session.add(withdrawal)
-            self.db.session.commit()
-            
-            self.logger.info(f"Withdrawal request created: user_id={user.user_id}, amount={amount}")
+            if withdrawal:
+                self.db.expire(User, user.id)
+                self.logger.info("Withdrawal request created: user_id=%s, amount=%s", user.user_id, amount)
             return withdrawal
         except Exception as e:
-            self.logger.error(f"Error creating withdrawal request: {e}")
-            self.db.session.rollback()
+            self.logger.error("Error creating withdrawal request: %s", e)
             return None
     
-    def process_withdrawal(self, withdrawal_id: int, approved: bool, admin_id: int) -> bool:
-        """Обработка заявки на вывод"""
+    @staticmethod
+    def _create_withdrawal_request_sync(session: Session, user_pk: int, amount: int,
+                                        method: str, details: str) -> Optional[WithdrawalRequest]:
+        """Списание средств и создание заявки в одной транзакции"""
+        if amount < MIN_WITHDRAW:
+            return None
+        
+        # Списываем средства условным UPDATE: из двух одновременных подтверждений
+        # пройдет только то, для которого баланса еще хватает
+        debited = session.execute(
+            update(User)
+            .where(User.id == user_pk, User.balance >= amount)
+            .values(balance=User.balance - amount)
+        ).rowcount
+        if not debited:
+            return None
+        
+        # Создаем заявку
+        withdrawal = WithdrawalRequest(
+            user_id=user_pk,
+            amount=amount,
+            method=method,
+            details=details,
+            date=datetime.now(),
+            status='pending'
+        )
+        session.add(withdrawal)
+        session.flush()
+        return withdrawal
+    
+    async def process_withdrawal(self, withdrawal_id: int, approved: bool,
+                                 admin_id: int) -> Optional[WithdrawalRequest]:
+        """Обработка заявки на вывод
+
+        Возвращает обработанную заявку (с загруженным пользователем) или None,
+        если заявки нет или она уже обработана.
+        """
         try:
-            withdrawal = self.db.session.query(WithdrawalRequest).get(withdrawal_id)
-            if not withdrawal:
-                return False
-            
-            withdrawal.status = 'approved' if approved else 'rejected'
-            withdrawal.processed_date = datetime.now()
-            withdrawal.processed_by = admin_id
-            
-            if approved:
-                withdrawal.user.withdrawals += withdrawal.amount
-            else:
-                # Возвращаем средства на баланс
-                withdrawal.user.balance += withdrawal.amount
-            
-            self.db.session.commit()
-            self.logger.info(f"Withdrawal {withdrawal_id} {'approved' if approved else 'rejected'}")
-            return True
+            withdrawal = await self.db.run_in_session(
+                self._process_withdrawal_sync, withdrawal_id, approved, admin_id
+            )
+            if withdrawal:
+                self.db.expire(User, withdrawal.user_id)
+                self.db.expire(WithdrawalRequest, withdrawal.id)
+                if self.on_change:
+                    self.on_change()
+                self.logger.info("Withdrawal %s %s", withdrawal_id, 'approved' if approved else 'rejected')
+            return withdrawal
         except Exception as e:
-            self.logger.error(f"Error processing withdrawal {withdrawal_id}: {e}")
-            self.db.session.rollback()
-            return False
+            self.logger.error("Error processing withdrawal %s: %s", withdrawal_id, e)
+            return None
+    
+    @staticmethod
+    def _process_withdrawal_sync(session: Session, withdrawal_id: int, approved: bool,
+                                 admin_id: int) -> Optional[WithdrawalRequest]:
+        """Смена статуса заявки и движение средств в одной транзакции"""
+        # Статус меняется условным UPDATE: при одновременных решениях (или повторном нажатии)
+        # средства двигает только первое, остальные увидят, что заявка уже не pending
+        changed = session.execute(
+            update(WithdrawalRequest)
+            .where(WithdrawalRequest.id == withdrawal_id, WithdrawalRequest.status == 'pending')
+            .values(
+                status='approved' if approved else 'rejected',
+                processed_date=datetime.now(),
+                processed_by=admin_id
+            )
+        ).rowcount
+        if not changed:
+            return None
+        
+        withdrawal = session.get(WithdrawalRequest, withdrawal_id)
+        if approved:
+            funds = {'withdrawals': User.withdrawals + withdrawal.amount}
+        else:
+            # Возвращаем средства на баланс
+            funds = {'balance': User.balance + withdrawal.amount}
+        session.execute(update(User).where(User.id == withdrawal.user_id).values(**funds))
+        
+        # Пользователь нужен для уведомления - загружаем его до закрытия сессии
+        withdrawal.user
+        return withdrawal
+
+# Статусы пользователей: (минимальный заработок, название) по возрастанию порога
+_STATUS_TIERS = [
+    (0, "🥉 Новичок"),
+    (100, "🥈 Активный"),
+    (500, "🥇 Продвинутый"),
+    (1000, "👑 VIP"),
+]
+_STATUS_THRESHOLDS = [threshold for threshold, _ in _STATUS_TIERS]
+_STATUS_NAMES = [name for _, name in _STATUS_TIERS]
+
+# Места в рейтинге и статусы заявок на вывод: (эмодзи, подпись)
+_MEDALS = ("🥇", "🥈", "🥉", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣", "🔟")
+_WD_STATUS = {
+    'pending': ('⏳', 'В обработке'),
+    'approved': ('✅', 'Одобрена'),
+    'rejected': ('❌', 'Отклонена'),
+}
+_WD_STATUS_UNKNOWN = ('❓', 'Неизвестно')
+
+# Статические тексты зависят только от настроек, поэтому собираются один раз при импорте
+_BLOCKED_MESSAGE = """🚫 *ДОСТУП ОГРАНИЧЕН*
+
+❌ Ваш аккаунт временно заблокирован администрацией.
+
+📞 Для разблокировки обратитесь в поддержку:
+└ Напишите администратору с объяснением ситуации
+
+⚠️ Блокировка может быть связана с нарушением правил использования бота."""
+
+_INFO_MESSAGE = f"""💡 *КАК ЗАРАБОТАТЬ В БОТЕ*
+
+🚀 *Основные способы заработка:*
+
+1️⃣ *Партнёрская программа*
+├ Приглашайте друзей по реферальной ссылке
+├ Получайте {REFERRAL_BONUS:,}₽ за каждого активного друга
+├ Друг должен подписаться на канал и быть активным
+└ Неограниченное количество приглашений
+
+2️⃣ *Ежедневные бонусы*
+├ Получайте {DAILY_BONUS:,}₽ каждый день
+├ Бонус доступен каждые 24 часа
+├ Создавайте серии для дополнительных наград
+└ Максимальная серия увеличивает бонус
+
+3️⃣ *Инвестиционные планы*
+├ 🌱 Стартер: от 100₽ • 1.2% в день
+├ 💎 Стандарт: от 1,000₽ • 1.8% в день  
+├ 🚀 Премиум: от 5,000₽ • 2.5% в день
+└ 👑 VIP: от 20,000₽ • 3.5% в день
+
+4️⃣ *Система достижений*
+├ 🥉 Новичок: 0-99₽ заработано
+├ 🥈 Активный: 100-499₽ заработано
+├ 🥇 Продвинутый: 500-999₽ заработано
+└ 👑 VIP: 1,000₽+ заработано
+
+💸 *Вывод средств:*
+├ Минимальная сумма: {MIN_WITHDRAW:,}₽
+├ Доступные системы: Карта, QIWI, ЮMoney, Крипта
+├ Обработка заявок: до 24 часов
+└ Комиссия: 0% (мы платим за вас!)
+
+🎯 *Советы для максимального заработка:*
+• Заходите каждый день за бонусом
+• Приглашайте активных друзей
+• Инвестируйте для пассивного дохода
+• Следите за новостями в канале"""
 
 class MessageBuilder:
     """Строитель сообщений для бота"""
@@ -205,15 +396,8 @@ class MessageBuilder:
     @staticmethod
     def build_welcome_message(user: User, user_name: str) -> str:
         """Построить приветственное сообщение"""
-        # Определяем статус пользователя
-        if user.total_earned >= 1000:
-            status = "👑 VIP"
-        elif user.total_earned >= 500:
-            status = "🥇 Продвинутый"
-        elif user.total_earned >= 100:
-            status = "🥈 Активный"
-        else:
-            status = "🥉 Новичок"
+        # Определяем статус пользователя по порогам заработка
+        status = _STATUS_NAMES[max(bisect_right(_STATUS_THRESHOLDS, user.total_earned) - 1, 0)]
         
         return f"""🚀 *Добро пожаловать, {user_name}!*
 
@@ -228,15 +412,20 @@ class MessageBuilder:
 🎯 Выберите действие для продолжения:"""
     
     @staticmethod
-    def build_stats_message(user: User) -> str:
-        """Построить сообщение статистики"""
-        ref_count = len(user.referrals)
-        ref_earnings = sum(r.bonus_paid for r in user.referrals)
-        invest_earnings = sum(i.total_profit for i in user.investments)
-        active_investments = len([i for i in user.investments if not i.is_finished])
+    def build_stats_message(user: User, stats: Dict[str, Any]) -> str:
+        """Построить сообщение статистики
+
+        stats - агрегаты по рефералам и инвестициям, посчитанные в БД
+        (см. TelegramBot._compute_user_stats), чтобы не загружать связанные строки.
+        """
+        ref_count = stats['ref_count']
+        ref_earnings = stats['ref_earnings']
+        total_invested = stats['total_invested']
+        invest_earnings = stats['invest_earnings']
+        active_investments = stats['active_investments']
         
         # Расчет ROI
-        roi = (user.total_earned / max(user.total_invested, 1)) * 100 if user.total_invested > 0 else 0
+        roi = (user.total_earned / max(total_invested, 1)) * 100 if total_invested > 0 else 0
         
         return f"""📊 *ДЕТАЛЬНАЯ СТАТИСТИКА*
 
@@ -252,10 +441,10 @@ class MessageBuilder:
 └ Средний доход с реферала: *{format_currency(ref_earnings / max(ref_count, 1))}*
 
 📈 *Инвестиционная деятельность:*
-├ Всего инвестировано: *{format_currency(user.total_invested)}*
+├ Всего инвестировано: *{format_currency(total_invested)}*
 ├ Прибыль с инвестиций: *{format_currency(invest_earnings)}*
 ├ Активных планов: *{active_investments}*
-└ Завершённых планов: *{len(user.investments) - active_investments}*
+└ Завершённых планов: *{stats['total_investments'] - active_investments}*
 
 📅 *Активность:*
 ├ Дата регистрации: {user.join_date.strftime('%d.%m.%Y')}
@@ -277,7 +466,7 @@ class MessageBuilder:
 ├ Выплачено: *{format_currency(stats.get('total_withdrawals', 0))}*
 └ Инвестировано: *{format_currency(stats.get('total_investments', 0))}*
 
-🕐 Обновлено: {datetime.now().strftime('%d.%m.%Y %H:%M')}"""
+🕐 Обновлено: {format_now('%d.%m.%Y %H:%M')}"""
     
     @staticmethod
     def build_bonus_message(amount: int, balance: int, streak: int = 1) -> str:
@@ -294,50 +483,74 @@ class MessageBuilder:
     @staticmethod
     def build_info_message() -> str:
         """Построить информационное сообщение"""
-        return f"""💡 *КАК ЗАРАБОТАТЬ В БОТЕ*
-
-🚀 *Основные способы заработка:*
-
-1️⃣ *Партнёрская программа*
-├ Приглашайте друзей по реферальной ссылке
-├ Получайте {REFERRAL_BONUS:,}₽ за каждого активного друга
-├ Друг должен подписаться на канал и быть активным
-└ Неограниченное количество приглашений
-
-2️⃣ *Ежедневные бонусы*
-├ Получайте {DAILY_BONUS:,}₽ каждый день
-├ Бонус доступен каждые 24 часа
-├ Создавайте серии для дополнительных наград
-└ Максимальная серия увеличивает бонус
+        return _INFO_MESSAGE
+    
+    @staticmethod
+    def build_top_users_message(top_users: List[Dict[str, Any]], names: List[Any]) -> str:
+        """Построить сообщение рейтинга
 
-3️⃣ *Инвестиционные планы*
-├ 🌱 Стартер: от 100₽ • 1.2% в день
-├ 💎 Стандарт: от 1,000₽ • 1.8% в день  
-├ 🚀 Премиум: от 5,000₽ • 2.5% в день
-└ 👑 VIP: от 20,000₽ • 3.5% в день
+        names - имена пользователей в том же порядке; исключение вместо имени заменяется на ID.
+        """
+        parts = ["🏆 *ТОП-10 УСПЕШНЫХ ПОЛЬЗОВАТЕЛЕЙ*\n\n"]
+        
+        for i, (user, name) in enumerate(zip(top_users, names)):
+            if isinstance(name, Exception):
+                name = f"Пользователь {user['user_id']}"
+            
+            parts.append(
+                f"{_MEDALS[i]} *{name}*\n"
+                f"├ Заработано: *{format_currency(user['total_earned'])}*\n"
+                f"├ Рефералов: *{user['refs_count']}*\n"
+                f"└ Активных инвестиций: *{user['investments_count']}*\n\n"
+            )
+        
+        parts.append("💡 *Станьте частью топа! Приглашайте друзей и инвестируйте.*")
+        return "".join(parts)
+    
+    @staticmethod
+    def build_withdrawal_history_message(withdrawals: List[WithdrawalRequest], totals: Dict[str, Any]) -> str:
+        """Построить сообщение истории выводов
 
-4️⃣ *Система достижений*
-├ 🥉 Новичок: 0-99₽ заработано
-├ 🥈 Активный: 100-499₽ заработано
-├ 🥇 Продвинутый: 500-999₽ заработано
-└ 👑 VIP: 1,000₽+ заработано
+        totals - итоги по всем заявкам пользователя (см. TelegramBot._fetch_withdrawal_history).
+        """
+        if not withdrawals:
+            return f"""📋 *ИСТОРИЯ ВЫВОДОВ*
 
-💸 *Вывод средств:*
-├ Минимальная сумма: {MIN_WITHDRAW:,}₽
-├ Доступные системы: Карта, QIWI, ЮMoney, Крипта
-├ Обработка заявок: до 24 часов
-└ Комиссия: 0% (мы платим за вас!)
+❌ У вас пока нет заявок на вывод средств
 
-🎯 *Советы для максимального заработка:*
-• Заходите каждый день за бонусом
-• Приглашайте активных друзей
-• Инвестируйте для пассивного дохода
-• Следите за новостями в канале"""
+💡 Минимальная сумма для вывода: {MIN_WITHDRAW:,}₽
+🚀 Начните зарабатывать уже сегодня!"""
+        
+        parts = [
+            "📋 *ИСТОРИЯ ВЫВОДОВ*\n\n",
+            "📊 *Общая статистика:*\n",
+            f"├ Всего заявок: *{totals['total']}*\n",
+            f"├ Одобрено: *{totals['approved']}*\n",
+            f"└ Сумма заявок: *{format_currency(totals['amount'])}*\n\n",
+        ]
+        
+        for w in withdrawals[:5]:  # Показываем только последние 5
+            status_emoji, status_text = _WD_STATUS.get(w.status, _WD_STATUS_UNKNOWN)
+            
+            parts.append(
+                f"🆔 *Заявка #{w.id}*\n"
+                f"├ Сумма: *{format_currency(w.amount)}*\n"
+                f"├ Система: *{w.method.upper()}*\n"
+                f"├ Дата: {w.date.strftime('%d.%m.%Y %H:%M')}\n"
+                f"└ Статус: {status_emoji} {status_text}\n\n"
+            )
+        
+        return "".join(parts)
 
 class KeyboardBuilder:
-    """Строитель клавиатур для бота"""
+    """Строитель клавиатур для бота
+
+    Разметка зависит только от аргументов, а объекты PTB неизменяемы,
+    поэтому готовые клавиатуры кэшируются и переиспользуются между обновлениями.
+    """
     
     @staticmethod
+    @lru_cache(maxsize=2)
     def build_main_keyboard(is_admin: bool = False) -> InlineKeyboardMarkup:
         """Построить главную клавиатуру с улучшенным дизайном"""
         keyboard = [
@@ -371,6 +584,7 @@ class KeyboardBuilder:
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
+    @lru_cache(maxsize=1)
     def build_admin_keyboard() -> InlineKeyboardMarkup:
         """Построить клавиатуру админ-панели с улучшенным дизайном"""
         return InlineKeyboardMarkup([
@@ -396,6 +610,7 @@ class KeyboardBuilder:
         ])
     
     @staticmethod
+    @lru_cache(maxsize=256)
     def build_payment_keyboard(amount: int) -> InlineKeyboardMarkup:
         """Построить клавиатуру выбора способа оплаты"""
         return InlineKeyboardMarkup([
@@ -413,6 +628,7 @@ class KeyboardBuilder:
         ])
     
     @staticmethod
+    @lru_cache(maxsize=32)
     def build_back_keyboard(callback_data: str = 'menu') -> InlineKeyboardMarkup:
         """Построить клавиатуру с кнопкой назад"""
         return InlineKeyboardMarkup([[
@@ -429,20 +645,88 @@ class KeyboardBuilder:
             ]
         ])
 
+# Сколько секунд статистика админ-панели берется из кэша
+_ADMIN_STATS_TTL = 30
+
+# Период записи накопленных отметок о подписке на канал (сек)
+CHANNEL_JOINED_FLUSH_INTERVAL = 1
+
+# Сколько секунд ждать доставки уведомления админам об аварийной остановке
+CRASH_NOTIFY_TIMEOUT = 10
+
+# Уведомление об аварийной остановке. HTML вместо Markdown: текст исключения экранируется
+# html.escape, и символы вроде _ или * в нем не ломают разметку сообщения
+ADMIN_ERROR_TEMPLATE = """🚨 <b>КРИТИЧЕСКАЯ ОШИБКА БОТА</b>
+
+Бот @{bot}
+был аварийно остановлен:
+<code>{exc_type}: {exc_msg}</code>"""
+
 class TelegramBot:
     """Основной класс бота с улучшениями"""
     
     def __init__(self):
         self.logger = BotLogger.setup_logging()
         self.db = Database()
-        self.user_service = UserService(self.db)
+        self.user_service = UserService(self.db, on_change=self._invalidate_admin_stats)
         self.bonus_service = BonusService(self.db)
-        self.withdrawal_service = WithdrawalService(self.db)
+        self.withdrawal_service = WithdrawalService(self.db, on_change=self._invalidate_admin_stats)
+        
+        # Пользователи, чья подписка на канал еще не записана в БД (первичные ключи)
+        self._pending_channel_joined: Set[int] = set()
+        
+        # Имена пользователей для рейтинга: меняются редко, а getChat - запрос к Telegram.
+        # Недоступные чаты (удаленные аккаунты) запоминаются отдельно, чтобы не запрашивать их снова
+        self._display_name_cache = TTLCache(maxsize=50_000, ttl=86400)
+        self._missing_chat = TTLCache(maxsize=10_000, ttl=3600)
+        
+        # Кэш статистики для админов: {отчет: (время расчета, статистика)}; блокировка
+        # объединяет одновременные запросы админов в один расчет
+        self._admin_stats_cache: Dict[str, Tuple[float, Any]] = {}
+        self._admin_stats_lock = asyncio.Lock()
+        
+        # Маршруты callback-команд с точным совпадением: один поиск в словаре вместо цепочки сравнений
+        self._callback_routes = {
+            'balance': show_balance,
+            'stats': self._show_user_stats,
+            'investments': show_investments,
+            'withdraw': handle_withdraw_request,
+            'bonus': self.handle_daily_bonus,
+            'referral': show_referral_program,
+            'top': self._show_top_users,
+            'info': self._show_info,
+            'history': self._show_withdrawal_history,
+            'menu': self.start,
+            'check_subscription': self._handle_check_subscription,
+        }
+        self._admin_callback_routes = {
+            'admin_panel': self.show_admin_panel,
+            'admin_stats': self._show_detailed_stats,
+            # Действия с вводом вызываются напрямую, без повторного разбора callback_data
+            **{action: partial(prompt_admin_input, action=action) for action in ADMIN_INPUT_PROMPTS},
+        }
+        # Маршруты по префиксу сгруппированы по первому сегменту callback_data (до "_"),
+        # поэтому для любой команды проверяется не больше пары префиксов
+        self._prefix_routes = self._build_prefix_routes([
+            ('invest_', handle_investment_request),
+            ('confirm_invest_', handle_investment_request),
+            ('calc_', handle_investment_request),
+            ('confirm_withdraw_', process_withdrawal),
+            ('payment_', process_withdrawal),
+            ('withdraw_', self._handle_withdraw_amount),
+        ])
+        self._admin_prefix_routes = self._build_prefix_routes([
+            ('approve_', self._handle_withdrawal_decision),
+            ('reject_', self._handle_withdrawal_decision),
+        ])
         
         self.logger.info("🚀 Bot initialized successfully")
     
     def setup_handlers(self, application: Application) -> None:
         """Настройка обработчиков команд"""
+        # Пользователь загружается один раз на обновление до всех остальных обработчиков
+        application.add_handler(TypeHandler(Update, self._prefetch_user), group=-1)
+        
         # Основные команды
         application.add_handler(CommandHandler("start", self.start))
         application.add_handler(CommandHandler("admin", handle_admin_command))
@@ -458,6 +742,26 @@ class TelegramBot:
         
         self.logger.info("✅ Handlers configured successfully")
     
+    async def _prefetch_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Загрузить пользователя обновления в context.user_data['_user']"""
+        if update.effective_user and context.user_data is not None:
+            context.user_data['_user'] = self.db.get_user(update.effective_user.id)
+            context.user_data['_is_admin'] = self.user_service.is_admin(update.effective_user.id)
+    
+    def _is_admin(self, context: ContextTypes.DEFAULT_TYPE, user_id: int) -> bool:
+        """Права админа для текущего обновления: из предзагрузки, иначе проверкой"""
+        is_admin = context.user_data.get('_is_admin') if context.user_data is not None else None
+        if is_admin is None:
+            is_admin = self.user_service.is_admin(user_id)
+        return is_admin
+    
+    def _current_user(self, context: ContextTypes.DEFAULT_TYPE, user_id: int) -> Optional[User]:
+        """Пользователь текущего обновления: из предзагрузки, иначе запросом к БД"""
+        user = context.user_data.get('_user') if context.user_data is not None else None
+        if user is None or user.user_id != user_id:
+            user = self.db.get_user(user_id)
+        return user
+    
     async def post_init(self, application: Application) -> None:
         """Инициализация после запуска"""
         try:
@@ -465,37 +769,99 @@ class TelegramBot:
             self.db.init_db()
             self.logger.info("✅ Database initialized")
             
+            # Отметки о подписке на канал пишутся в БД пачками раз в секунду
+            application.job_queue.run_repeating(
+                self._flush_channel_joined, interval=CHANNEL_JOINED_FLUSH_INTERVAL,
+                first=CHANNEL_JOINED_FLUSH_INTERVAL, name='channel_joined'
+            )
+            
             # Получение информации о боте
             bot_info = await application.bot.get_me()
-            self.logger.info(f"✅ Bot @{bot_info.username} started successfully")
+            self.logger.info("✅ Bot @%s started successfully", bot_info.username)
             
         except Exception as e:
-            self.logger.error(f"❌ Error in post_init: {e}")
+            self.logger.error("❌ Error in post_init: %s", e, exc_info=True)
             raise
     
     async def cleanup(self, application: Application) -> None:
         """Очистка ресурсов при завершении"""
         try:
-            if hasattr(self.db, 'session') and self.db.session:
-                self.db.session.close()
+            # Дописываем накопленные отметки о подписке до остановки пула потоков БД
+            await self._write_channel_joined()
+            self.db.session.close()
+            self.db.executor.shutdown(wait=True)
             self.logger.info("✅ Resources cleaned up")
         except Exception as e:
-            self.logger.error(f"❌ Error in cleanup: {e}")
+            self.logger.error("❌ Error in cleanup: %s", e, exc_info=True)
+        finally:
+            BotLogger.shutdown_logging()
+    
+    def _mark_channel_joined(self, user: User) -> None:
+        """Отметить подписку пользователя; запись в БД выполнит _flush_channel_joined"""
+        # set_committed_value не помечает объект измененным, чтобы чужой commit не записал его раньше
+        set_committed_value(user, 'channel_joined', True)
+        self._pending_channel_joined.add(user.id)
+    
+    async def _flush_channel_joined(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Периодическая задача записи отметок о подписке"""
+        await self._write_channel_joined()
+    
+    async def _write_channel_joined(self) -> None:
+        """Записать накопленные отметки о подписке одним UPDATE"""
+        if not self._pending_channel_joined:
+            return
+        
+        user_pks, self._pending_channel_joined = self._pending_channel_joined, set()
+        try:
+            await self.db.run_in_session(self._write_channel_joined_sync, list(user_pks))
+        except Exception as e:
+            # Вернем отметки в очередь, чтобы записать их в следующий раз
+            self._pending_channel_joined |= user_pks
+            self.logger.error("Error writing channel_joined flags: %s", e)
+    
+    @staticmethod
+    def _write_channel_joined_sync(session: Session, user_pks: List[int]) -> None:
+        """UPDATE users SET channel_joined = TRUE для пачки пользователей"""
+        session.execute(update(User).where(User.id.in_(user_pks)).values(channel_joined=True))
+    
+    async def _edit_message(self, query, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None) -> None:
+        """Отредактировать сообщение callback-запроса, если его содержимое изменилось
+
+        Повторное нажатие той же кнопки дало бы "message is not modified" и лишний запрос
+        к Bot API. Telegram присылает текущее сообщение вместе с callback, поэтому новое
+        содержимое сравнивается прямо с ним: отметка не устаревает, даже если сообщение
+        редактировал другой обработчик.
+        """
+        message = query.message
+        if message is not None and message.reply_markup == reply_markup:
+            try:
+                # Telegram обрезает пробелы по краям текста
+                unchanged = message.text_markdown == text.strip()
+            except ValueError:
+                # Разметку сообщения нельзя выразить в Markdown v1 - считаем, что текст изменился
+                unchanged = False
+            if unchanged:
+                # Callback уже подтвержден в button_handler, больше ничего отправлять не нужно
+                return
+        
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
     
     async def handle_daily_bonus(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Обработка ежедневного бонуса с улучшениями"""
         try:
             user_id = update.callback_query.from_user.id
-            user = self.db.get_user(user_id)
+            user = self._current_user(context, user_id)
             
             if not user:
-                await update.callback_query.edit_message_text(
-                    text="❌ Пользователь не найден. Пожалуйста, начните с /start.",
-                    parse_mode=ParseMode.MARKDOWN
+                await self._edit_message(
+                    update.callback_query,
+                    "❌ Пользователь не найден. Пожалуйста, начните с /start."
                 )
                 return
             
-            can_claim, time_left = self.bonus_service.can_claim_daily_bonus(user)
+            # Одно время на всю обработку: проверка и начисление не разойдутся на границе суток
+            now = datetime.now()
+            can_claim, time_left = self.bonus_service.can_claim_daily_bonus(user, now)
             
             if not can_claim:
                 hours = int(time_left.total_seconds() / 3600)
@@ -507,30 +873,26 @@ class TelegramBot:
                 )
                 return
             
-            if self.bonus_service.claim_daily_bonus(user):
+            if await self.bonus_service.claim_daily_bonus(user, now):
                 # Рассчитываем серию дней
-                streak = self._calculate_bonus_streak(user)
+                streak = self._calculate_bonus_streak(user, now)
                 
                 bonus_text = MessageBuilder.build_bonus_message(DAILY_BONUS, user.balance, streak)
                 keyboard = KeyboardBuilder.build_back_keyboard('menu')
                 
-                await update.callback_query.edit_message_text(
-                    bonus_text,
-                    reply_markup=keyboard,
-                    parse_mode=ParseMode.MARKDOWN
-                )
+                await self._edit_message(update.callback_query, bonus_text, keyboard)
             else:
                 await update.callback_query.answer("❌ Ошибка при начислении бонуса", show_alert=True)
                 
         except Exception as e:
-            self.logger.error(f"Error in handle_daily_bonus: {e}")
+            self.logger.error("Error in handle_daily_bonus: %s", e)
             await self._send_error_message(update, "Ошибка при получении бонуса")
     
-    def _calculate_bonus_streak(self, user: User) -> int:
+    def _calculate_bonus_streak(self, user: User, now: datetime) -> int:
         """Рассчитать серию дней получения бонуса"""
         # Простая реализация - можно улучшить
         if user.last_bonus:
-            days_diff = (datetime.now() - user.last_bonus).days
+            days_diff = (now - user.last_bonus).days
             return max(1, 7 - days_diff) if days_diff <= 1 else 1
         return 1
     
@@ -540,28 +902,17 @@ class TelegramBot:
             query = update.callback_query
             user_id = query.from_user.id
             
-            if not self.user_service.is_admin(user_id):
+            if not self._is_admin(context, user_id):
                 await query.answer("❌ Недостаточно прав", show_alert=True)
                 return
 
-            stats = self.db.get_user_statistics()
-            # Добавляем дополнительную статистику
-            stats.update({
-                'total_balance': sum(u.balance for u in self.db.session.query(User).all()),
-                'total_withdrawals': sum(u.withdrawals for u in self.db.session.query(User).all()),
-                'total_investments': sum(u.total_invested for u in self.db.session.query(User).all()),
-                'new_today': self.db.get_new_users_today_count()
-            })
+            stats = await self._get_admin_stats('panel', self._compute_admin_stats)
             
             stats_text = MessageBuilder.build_admin_panel_message(stats)
             keyboard = KeyboardBuilder.build_admin_keyboard()
 
             if update.callback_query:
-                await query.edit_message_text(
-                    stats_text,
-                    reply_markup=keyboard,
-                    parse_mode=ParseMode.MARKDOWN
-                )
+                await self._edit_message(query, stats_text, keyboard)
             else:
                 await update.message.reply_text(
                     stats_text,
@@ -569,9 +920,58 @@ class TelegramBot:
                     parse_mode=ParseMode.MARKDOWN
                 )
         except Exception as e:
-            self.logger.error(f"Error in show_admin_panel: {e}")
+            self.logger.error("Error in show_admin_panel: %s", e)
             await self._send_error_message(update, "Ошибка при загрузке админ-панели")
     
+    async def _get_admin_stats(self, report: str, compute: Callable[[Session], Any]) -> Any:
+        """Статистика для админов, кэшируется на _ADMIN_STATS_TTL секунд
+
+        compute выполняется в пуле потоков БД только при отсутствии свежего значения в кэше.
+        """
+        async with self._admin_stats_lock:
+            cached = self._admin_stats_cache.get(report)
+            if cached and time.monotonic() - cached[0] < _ADMIN_STATS_TTL:
+                return cached[1]
+            
+            stats = await self.db.run_in_session(compute)
+            self._admin_stats_cache[report] = (time.monotonic(), stats)
+            return stats
+    
+    def _invalidate_admin_stats(self) -> None:
+        """Сбросить кэш статистики для админов"""
+        self._admin_stats_cache.clear()
+    
+    @staticmethod
+    def _compute_user_aggregates(session: Session) -> Dict[str, Any]:
+        """Все агрегаты по пользователям одним запросом"""
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        (total_users, active_users, blocked_users, total_balance,
+         total_withdrawals, new_today, avg_earnings) = session.query(
+            func.count(User.id),
+            func.count(case((User.channel_joined == True, 1))),
+            func.count(case((User.is_blocked == True, 1))),
+            func.coalesce(func.sum(User.balance), 0),
+            func.coalesce(func.sum(User.withdrawals), 0),
+            func.count(case((User.join_date >= today, 1))),
+            func.coalesce(func.avg(User.total_earned), 0)
+        ).one()
+        return {
+            'total_users': total_users,
+            'active_users': active_users,
+            'blocked_users': blocked_users,
+            'total_balance': total_balance,
+            'total_withdrawals': total_withdrawals,
+            'new_today': new_today,
+            'avg_earnings': avg_earnings
+        }
+    
+    @classmethod
+    def _compute_admin_stats(cls, session: Session) -> Dict[str, Any]:
+        """Статистика для админ-панели (блокирующие запросы, выполняется в пуле потоков БД)"""
+        stats = cls._compute_user_aggregates(session)
+        stats['total_investments'] = session.query(func.coalesce(func.sum(Investment.amount), 0)).scalar()
+        return stats
+    
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Команда /start с улучшениями"""
         try:
@@ -587,48 +987,39 @@ class TelegramBot:
             user_name = update.effective_user.first_name or "Друг"
             ref = context.args[0] if context.args else None
             
+            user = self._current_user(context, user_id)
+            
             # Проверка на блокировку
-            if self.user_service.is_blocked(user_id):
-                blocked_text = """🚫 *ДОСТУП ОГРАНИЧЕН*
-
-❌ Ваш аккаунт временно заблокирован администрацией.
-
-📞 Для разблокировки обратитесь в поддержку:
-└ Напишите администратору с объяснением ситуации
-
-⚠️ Блокировка может быть связана с нарушением правил использования бота."""
-                
+            if user and user.is_blocked:
                 if update.message:
-                    await update.message.reply_text(blocked_text, parse_mode=ParseMode.MARKDOWN)
+                    await update.message.reply_text(_BLOCKED_MESSAGE, parse_mode=ParseMode.MARKDOWN)
                 return
             
-            # Получаем или создаем пользователя
-            user = self.db.get_user(user_id)
+            # Создаем пользователя, если его еще нет
             if not user:
                 ref_id = int(ref) if ref and ref.isdigit() else None
                 user = await self.user_service.create_user(user_id, ref_id)
+                context.user_data['_user'] = user
+            
+            is_admin = self._is_admin(context, user_id)
             
             # Проверка подписки на канал (админы проходят без проверки)
-            if not self.user_service.is_admin(user_id):
+            if not is_admin:
                 is_subscribed = await check_channel_subscription(context, user_id)
                 if not is_subscribed:
                     await show_channel_check(update, context)
                     return
             
-            # Обновляем статус подписки
-            if not user.channel_joined:
-                user.channel_joined = True
-                self.db.session.commit()
+            # Обновляем статус подписки: в памяти сразу, в БД - фоновой пачкой. Очередь на запись
+            # проверяется отдельно: значение в объекте пропадет, если его истечет запись в другой сессии
+            if not user.channel_joined and user.id not in self._pending_channel_joined:
+                self._mark_channel_joined(user)
             
             welcome_text = MessageBuilder.build_welcome_message(user, user_name)
-            keyboard = KeyboardBuilder.build_main_keyboard(self.user_service.is_admin(user_id))
+            keyboard = KeyboardBuilder.build_main_keyboard(is_admin)
 
             if update.callback_query:
-                await update.callback_query.edit_message_text(
-                    welcome_text,
-                    reply_markup=keyboard,
-                    parse_mode=ParseMode.MARKDOWN
-                )
+                await self._edit_message(update.callback_query, welcome_text, keyboard)
             else:
                 await update.message.reply_text(
                     welcome_text,
@@ -636,7 +1027,7 @@ class TelegramBot:
                     parse_mode=ParseMode.MARKDOWN
                 )
         except Exception as e:
-            self.logger.error(f"Error in start command: {e}")
+            self.logger.error("Error in start command: %s", e)
             await self._send_error_message(update, "Ошибка при запуске бота")
     
     async def button_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -646,13 +1037,14 @@ class TelegramBot:
             await query.answer()
             user_id = query.from_user.id
             
+            user = self._current_user(context, user_id)
+            
             # Проверка на блокировку
-            if self.user_service.is_blocked(user_id):
+            if user and user.is_blocked:
                 await query.answer("❌ Вы заблокированы в боте", show_alert=True)
                 return
             
             # Проверка существования пользователя
-            user = self.db.get_user(user_id)
             if not user:
                 await query.edit_message_text(
                     "❌ Пожалуйста, начните сначала с команды /start",
@@ -661,7 +1053,7 @@ class TelegramBot:
                 return
             
             # Проверка подписки на канал для обычных пользователей
-            if query.data != 'check_subscription' and not self.user_service.is_admin(user_id):
+            if query.data != 'check_subscription' and not self._is_admin(context, user_id):
                 is_subscribed = await check_channel_subscription(context, user_id)
                 if not is_subscribed:
                     await show_channel_check(update, context)
@@ -671,83 +1063,170 @@ class TelegramBot:
             await self._route_callback(update, context, query.data)
             
         except Exception as e:
-            self.logger.error(f"Error in button_handler: {e}")
+            self.logger.error("Error in button_handler: %s", e)
             await self._send_error_message(update, "Ошибка при обработке команды")
     
     async def _route_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, data: str) -> None:
         """Улучшенная маршрутизация callback команд"""
         user_id = update.effective_user.id
         
-        # Админ функции
-        if data == 'admin_panel' and self.user_service.is_admin(user_id):
-            await self.show_admin_panel(update, context)
-        elif data == 'admin_stats' and self.user_service.is_admin(user_id):
-            await self._show_detailed_stats(update, context)
-        
-        # Пользовательские функции
-        elif data == 'balance':
-            await show_balance(update, context)
-        elif data == 'stats':
-            await self._show_user_stats(update, context)
-        
-        # Инвестиции - улучшенная маршрутизация
-        elif data == 'investments':
-            await show_investments(update, context)
-        elif data.startswith(('invest_', 'confirm_invest_', 'calc_')):
-            await handle_investment_request(update, context)
-        
-        # Вывод средств
-        elif data == 'withdraw':
-            await handle_withdraw_request(update, context)
-        elif data.startswith('withdraw_'):
-            amount = int(data.split('_')[1])
-            await handle_withdraw_request(update, context, amount)
-        elif data.startswith('payment_'):
-            parts = data.split('_')
-            method, amount = parts[1], int(parts[2])
-            await handle_payment_details(update, context, method, amount)
-        
-        # Остальные функции
-        elif data == 'bonus':
-            await self.handle_daily_bonus(update, context)
-        elif data == 'referral':
-            await show_referral_program(update, context)
-        elif data == 'top':
-            await self._show_top_users(update, context)
-        elif data == 'info':
-            await self._show_info(update, context)
-        elif data == 'history':
-            await self._show_withdrawal_history(update, context)
-        elif data == 'menu':
+        # Команды с точным совпадением
+        handler = self._callback_routes.get(data)
+        if handler is None and self._is_admin(context, user_id):
+            handler = self._admin_callback_routes.get(data)
+        
+        # Команды с параметрами
+        if handler is None:
+            handler = self._match_prefix(self._prefix_routes, data)
+        if handler is None and self._is_admin(context, user_id):
+            handler = self._match_prefix(self._admin_prefix_routes, data)
+        
+        await (handler or self._handle_unknown_callback)(update, context)
+    
+    @staticmethod
+    def _match_prefix(routes: Dict[str, Tuple[Tuple[str, Callable], ...]], data: str) -> Optional[Callable]:
+        """Обработчик из таблицы _build_prefix_routes для callback_data или None"""
+        for prefix, handler in routes.get(data.partition('_')[0], ()):
+            if data.startswith(prefix):
+                return handler
+        return None
+    
+    @staticmethod
+    def _build_prefix_routes(routes: List[Tuple[str, Callable]]) -> Dict[str, Tuple[Tuple[str, Callable], ...]]:
+        """Сгруппировать маршруты по первому сегменту префикса; длинные префиксы проверяются первыми"""
+        grouped: Dict[str, List[Tuple[str, Callable]]] = {}
+        for prefix, handler in routes:
+            grouped.setdefault(prefix.partition('_')[0], []).append((prefix, handler))
+        return {
+            head: tuple(sorted(group, key=lambda route: len(route[0]), reverse=True))
+            for head, group in grouped.items()
+        }
+    
+    async def _handle_withdraw_amount(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Вывод выбранной суммы: withdraw_<сумма>"""
+        amount = int(update.callback_query.data.partition('_')[2])
+        await handle_withdraw_request(update, context, amount)
+    
+    async def _handle_withdrawal_decision(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Решение админа по заявке: approve_<id> / reject_<id>"""
+        query = update.callback_query
+        action, _, withdrawal_id = query.data.partition('_')
+        approved = action == 'approve'
+        
+        withdrawal = await self.withdrawal_service.process_withdrawal(
+            int(withdrawal_id), approved, update.effective_user.id
+        )
+        if withdrawal is None:
+            # Заявка уже обработана другим админом или не существует - убираем кнопки
+            await query.edit_message_reply_markup(reply_markup=None)
+            return
+        
+        status_emoji, status_text = _WD_STATUS[withdrawal.status]
+        if approved:
+            user_text = (f"✅ Ваша заявка #{withdrawal.id} на вывод "
+                         f"{format_currency(withdrawal.amount)} одобрена")
+        else:
+            user_text = (f"❌ Ваша заявка #{withdrawal.id} на вывод {format_currency(withdrawal.amount)} "
+                         f"отклонена, средства возвращены на баланс")
+        
+        # Отметка у админа и уведомление пользователя независимы - отправляем параллельно
+        results = await asyncio.gather(
+            query.edit_message_text(f"{query.message.text}\n\n{status_emoji} {status_text}"),
+            self._notify_user(context.bot, withdrawal.user.user_id, user_text),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                self.logger.error("Error reporting withdrawal %s: %s", withdrawal.id, result)
+    
+    @staticmethod
+    async def _notify_user(bot, chat_id: int, text: str) -> None:
+        """Отправить пользователю уведомление с учетом лимитов Telegram"""
+        async with send_limiter.slot(chat_id):
+            await bot.send_message(chat_id=chat_id, text=text)
+    
+    async def _handle_check_subscription(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Повторная проверка подписки на канал"""
+        user_id = update.effective_user.id
+        if await check_channel_subscription(context, user_id, force=True):
             await self.start(update, context)
         else:
-            await self._handle_unknown_callback(update, context)
+            await update.callback_query.answer("❌ Подписка не найдена", show_alert=True)
+            await show_channel_check(update, context)
     
     async def _show_user_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Показать расширенную статистику пользователя"""
         user_id = update.effective_user.id
-        user = self.db.get_user(user_id)
+        user = self._current_user(context, user_id)
         
         if not user:
             await update.callback_query.edit_message_text(
-                text="❌ Пользователь не найден. Пожалуйста, начните с /start.",
-                parse_mode=ParseMode.MARKDOWN
+                text="❌ Пользователь не найден. Пожалуйста, начните с /start."
             )
             return
         
-        stats_text = MessageBuilder.build_stats_message(user)
+        stats = await self.db.run_in_session(self._compute_user_stats, user.id)
+        stats_text = MessageBuilder.build_stats_message(user, stats)
         keyboard = KeyboardBuilder.build_back_keyboard('menu')
         
-        await update.callback_query.edit_message_text(
-            stats_text,
-            reply_markup=keyboard,
-            parse_mode=ParseMode.MARKDOWN
+        await self._edit_message(update.callback_query, stats_text, keyboard)
+    
+    @staticmethod
+    def _compute_user_stats(session: Session, user_pk: int) -> Dict[str, Any]:
+        """Агрегаты для статистики пользователя одним запросом (выполняется в пуле потоков БД)"""
+        referrals = select(Referral).where(Referral.referrer_id == user_pk).subquery()
+        investments = select(Investment).where(Investment.user_id == user_pk).subquery()
+        row = session.execute(select(
+            select(func.count()).select_from(referrals).scalar_subquery(),
+            select(func.coalesce(func.sum(referrals.c.bonus_paid), 0)).scalar_subquery(),
+            select(func.count()).select_from(investments).scalar_subquery(),
+            select(func.count()).where(investments.c.is_finished == False).scalar_subquery(),
+            select(func.coalesce(func.sum(investments.c.amount), 0)).scalar_subquery(),
+            select(func.coalesce(func.sum(investments.c.current_profit), 0)).scalar_subquery()
+        )).one()
+        ref_count, ref_earnings, total_investments, active_investments, total_invested, invest_earnings = row
+        return {
+            'ref_count': ref_count,
+            'ref_earnings': ref_earnings,
+            'total_investments': total_investments,
+            'active_investments': active_investments,
+            'total_invested': total_invested,
+            'invest_earnings': invest_earnings
+        }
+    
+    @classmethod
+    def _compute_detailed_stats(cls, session: Session) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Статистика для подробного отчета: три агрегирующих запроса (выполняется в пуле потоков БД)"""
+        stats = cls._compute_user_aggregates(session)
+        stats['subscribed_users'] = stats['active_users']
+        
+        # Инвестиции и число реферальных связей
+        total_investments, total_profit_paid, active_investments, total_referrals = session.query(
+            func.coalesce(func.sum(Investment.amount), 0),
+            func.coalesce(func.sum(Investment.current_profit), 0),
+            func.count(case((Investment.is_finished == False, 1))),
+            select(func.count(Referral.id)).scalar_subquery()
+        ).one()
+        stats['total_referrals'] = total_referrals
+        
+        # Заявки на вывод по статусам
+        withdrawals_by_status = dict(
+            session.query(WithdrawalRequest.status, func.count(WithdrawalRequest.id))
+            .group_by(WithdrawalRequest.status)
+            .all()
         )
+        stats['pending_withdrawals'] = withdrawals_by_status.get('pending', 0)
+        
+        invest_stats = {
+            'total_investments': total_investments,
+            'total_profit_paid': total_profit_paid,
+            'active_investments': active_investments
+        }
+        return stats, invest_stats
     
     async def _show_detailed_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Показать подробную статистику для админов"""
-        stats = self.db.get_user_statistics()
-        invest_stats = self.db.get_investments_statistics()
+        stats, invest_stats = await self._get_admin_stats('detailed', self._compute_detailed_stats)
         
         stats_text = f"""📊 *ПОДРОБНАЯ СТАТИСТИКА СИСТЕМЫ*
 
@@ -770,52 +1249,83 @@ class TelegramBot:
 ├ Реферальных связей: *{stats.get('total_referrals', 0):,}*
 └ Средний доход на пользователя: *{format_currency(stats.get('avg_earnings', 0))}*
 
-🕐 Обновлено: {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}"""
+🕐 Обновлено: {format_now()}"""
 
         keyboard = KeyboardBuilder.build_back_keyboard('admin_panel')
-        await update.callback_query.edit_message_text(
-            stats_text,
-            reply_markup=keyboard,
-            parse_mode=ParseMode.MARKDOWN
+        await self._edit_message(update.callback_query, stats_text, keyboard)
+    
+    @staticmethod
+    def _compute_top_users(session: Session) -> List[Dict[str, Any]]:
+        """Топ-10 пользователей с числом рефералов и активных инвестиций (выполняется в пуле потоков БД)"""
+        top_users = session.query(User.id, User.user_id, User.total_earned)\
+            .order_by(User.total_earned.desc(), User.balance.desc())\
+            .limit(10)\
+            .all()
+        user_pks = [user.id for user in top_users]
+        
+        # Счетчики для всей десятки двумя сгруппированными запросами вместо загрузки связей
+        refs_counts = dict(
+            session.query(Referral.referrer_id, func.count(Referral.id))
+            .filter(Referral.referrer_id.in_(user_pks))
+            .group_by(Referral.referrer_id)
+            .all()
+        )
+        investments_counts = dict(
+            session.query(Investment.user_id, func.count(Investment.id))
+            .filter(Investment.user_id.in_(user_pks), Investment.is_finished == False)
+            .group_by(Investment.user_id)
+            .all()
         )
+        return [
+            {
+                'user_id': user.user_id,
+                'total_earned': user.total_earned,
+                'refs_count': refs_counts.get(user.id, 0),
+                'investments_count': investments_counts.get(user.id, 0)
+            }
+            for user in top_users
+        ]
+    
+    async def _get_display_name(self, bot, user_id: int) -> str:
+        """Имя пользователя для рейтинга
+
+        Имена кэшируются на сутки, недоступные чаты - на час; для них сразу
+        возвращается подпись с ID без запроса к Telegram.
+        """
+        name = self._display_name_cache.get(user_id)
+        if name is not None:
+            return name
+        if self._missing_chat.get(user_id):
+            return f"Пользователь {user_id}"
+        
+        try:
+            chat = await bot.get_chat(user_id)
+        except (BadRequest, Forbidden):
+            # Чат не найден или бот заблокирован; сетевые ошибки не кэшируются
+            self._missing_chat.set(user_id, True)
+            return f"Пользователь {user_id}"
+        
+        name = chat.first_name[:15] + "..." if len(chat.first_name) > 15 else chat.first_name
+        self._display_name_cache.set(user_id, name)
+        return name
     
     async def _show_top_users(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Показать топ пользователей с улучшенным дизайном"""
         try:
-            top_users = self.db.session.query(User)\
-                .order_by(User.total_earned.desc(), User.balance.desc())\
-                .limit(10)\
-                .all()
-            
-            top_text = "🏆 *ТОП-10 УСПЕШНЫХ ПОЛЬЗОВАТЕЛЕЙ*\n\n"
-            
-            medals = ["🥇", "🥈", "🥉"] + [f"{i}️⃣" for i in range(4, 11)]
+            top_users = await self.db.run_in_session(self._compute_top_users)
             
-            for i, user in enumerate(top_users):
-                try:
-                    chat = await context.bot.get_chat(user.user_id)
-                    name = chat.first_name[:15] + "..." if len(chat.first_name) > 15 else chat.first_name
-                except:
-                    name = f"Пользователь {user.user_id}"
-                
-                refs_count = len(user.referrals)
-                investments_count = len([inv for inv in user.investments if not inv.is_finished])
-                
-                top_text += f"{medals[i]} *{name}*\n"
-                top_text += f"├ Заработано: *{format_currency(user.total_earned)}*\n"
-                top_text += f"├ Рефералов: *{refs_count}*\n"
-                top_text += f"└ Активных инвестиций: *{investments_count}*\n\n"
+            # Имена запрашиваются у Telegram параллельно (и берутся из кэша, если уже известны)
+            names = await asyncio.gather(
+                *(self._get_display_name(context.bot, user['user_id']) for user in top_users),
+                return_exceptions=True
+            )
             
-            top_text += "💡 *Станьте частью топа! Приглашайте друзей и инвестируйте.*"
+            top_text = MessageBuilder.build_top_users_message(top_users, names)
             
             keyboard = KeyboardBuilder.build_back_keyboard('menu')
             
             if update.callback_query:
-                await update.callback_query.edit_message_text(
-                    top_text,
-                    reply_markup=keyboard,
-                    parse_mode=ParseMode.MARKDOWN
-                )
+                await self._edit_message(update.callback_query, top_text, keyboard)
             else:
                 await update.message.reply_text(
                     top_text,
@@ -823,7 +1333,7 @@ class TelegramBot:
                     parse_mode=ParseMode.MARKDOWN
                 )
         except Exception as e:
-            self.logger.error(f"Error in _show_top_users: {e}")
+            self.logger.error("Error in _show_top_users: %s", e)
             await self._send_error_message(update, "Ошибка при загрузке рейтинга")
     
     async def _show_info(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -832,11 +1342,7 @@ class TelegramBot:
         keyboard = KeyboardBuilder.build_back_keyboard('menu')
         
         if update.callback_query:
-            await update.callback_query.edit_message_text(
-                info_text,
-                reply_markup=keyboard,
-                parse_mode=ParseMode.MARKDOWN
-            )
+            await self._edit_message(update.callback_query, info_text, keyboard)
         else:
             await update.message.reply_text(
                 info_text,
@@ -848,58 +1354,15 @@ class TelegramBot:
         """Показать историю выводов с пагинацией"""
         try:
             user_id = update.effective_user.id
-            user = self.db.get_user(user_id)
-            withdrawals = self.db.session.query(WithdrawalRequest)\
-                .filter_by(user_id=user.user_id)\
-                .order_by(WithdrawalRequest.date.desc())\
-                .limit(10)\
-                .all()
+            user = self._current_user(context, user_id)
+            withdrawals, totals = await self.db.run_in_session(self._fetch_withdrawal_history, user.id)
             
-            if not withdrawals:
-                history_text = f"""📋 *ИСТОРИЯ ВЫВОДОВ*
-
-❌ У вас пока нет заявок на вывод средств
-
-💡 Минимальная сумма для вывода: {MIN_WITHDRAW:,}₽
-🚀 Начните зарабатывать уже сегодня!"""
-            else:
-                history_text = "📋 *ИСТОРИЯ ВЫВОДОВ*\n\n"
-                
-                total_requested = sum(w.amount for w in withdrawals)
-                approved_count = len([w for w in withdrawals if w.status == 'approved'])
-                
-                history_text += f"📊 *Общая статистика:*\n"
-                history_text += f"├ Всего заявок: *{len(withdrawals)}*\n"
-                history_text += f"├ Одобрено: *{approved_count}*\n"
-                history_text += f"└ Сумма заявок: *{format_currency(total_requested)}*\n\n"
-                
-                for w in withdrawals[:5]:  # Показываем только последние 5
-                    status_emoji = {
-                        'pending': '⏳',
-                        'approved': '✅',
-                        'rejected': '❌'
-                    }.get(w.status, '❓')
-                    
-                    status_text = {
-                        'pending': 'В обработке',
-                        'approved': 'Одобрена',
-                        'rejected': 'Отклонена'
-                    }.get(w.status, 'Неизвестно')
-                    
-                    history_text += f"🆔 *Заявка #{w.id}*\n"
-                    history_text += f"├ Сумма: *{format_currency(w.amount)}*\n"
-                    history_text += f"├ Система: *{w.method.upper()}*\n"
-                    history_text += f"├ Дата: {w.date.strftime('%d.%m.%Y %H:%M')}\n"
-                    history_text += f"└ Статус: {status_emoji} {status_text}\n\n"
+            history_text = MessageBuilder.build_withdrawal_history_message(withdrawals, totals)
             
             keyboard = KeyboardBuilder.build_back_keyboard('menu')
             
             if update.callback_query:
-                await update.callback_query.edit_message_text(
-                    history_text,
-                    reply_markup=keyboard,
-                    parse_mode=ParseMode.MARKDOWN
-                )
+                await self._edit_message(update.callback_query, history_text, keyboard)
             else:
                 await update.message.reply_text(
                     history_text,
@@ -907,9 +1370,33 @@ class TelegramBot:
                     parse_mode=ParseMode.MARKDOWN
                 )
         except Exception as e:
-            self.logger.error(f"Error in _show_withdrawal_history: {e}")
+            self.logger.error("Error in _show_withdrawal_history: %s", e)
             await self._send_error_message(update, "Ошибка при загрузке истории")
     
+    @staticmethod
+    def _fetch_withdrawal_history(session: Session, user_pk: int) -> Tuple[List[WithdrawalRequest], Dict[str, Any]]:
+        """Последние заявки пользователя и итоги по всем его заявкам одним запросом
+
+        Итоги считаются оконными функциями по всем строкам пользователя до LIMIT
+        (выполняется в пуле потоков БД).
+        """
+        rows = session.execute(
+            select(
+                WithdrawalRequest,
+                func.count().over().label('total'),
+                func.count(case((WithdrawalRequest.status == 'approved', 1))).over().label('approved'),
+                func.coalesce(func.sum(WithdrawalRequest.amount).over(), 0).label('amount')
+            )
+            .where(WithdrawalRequest.user_id == user_pk)
+            .order_by(WithdrawalRequest.date.desc())
+            .limit(10)
+        ).all()
+        if not rows:
+            return [], {'total': 0, 'approved': 0, 'amount': 0}
+        first = rows[0]
+        return [row.WithdrawalRequest for row in rows], \
+            {'total': first.total, 'approved': first.approved, 'amount': first.amount}
+    
     async def _handle_unknown_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Обработка неизвестных callback команд"""
         await update.callback_query.answer("❓ Неизвестная команда", show_alert=True)
@@ -921,67 +1408,151 @@ class TelegramBot:
             error_message = f"❌ {error_text}\n\n🔄 Попробуйте еще раз или обратитесь в поддержку."
             keyboard = KeyboardBuilder.build_back_keyboard('menu')
             
+            # Текст ошибки без разметки: parse_mode не нужен, и символы в error_text не сломают отправку
             if update.callback_query:
-                await update.callback_query.edit_message_text(
-                    error_message,
-                    reply_markup=keyboard,
-                    parse_mode=ParseMode.MARKDOWN
-                )
+                await update.callback_query.edit_message_text(error_message, reply_markup=keyboard)
             else:
-                await update.message.reply_text(
-                    error_message,
-                    reply_markup=keyboard,
-                    parse_mode=ParseMode.MARKDOWN
-                )
+                await update.message.reply_text(error_message, reply_markup=keyboard)
         except Exception as e:
-            self.logger.error(f"Error sending error message: {e}")
+            self.logger.error("Error sending error message: %s", e)
+
+# Типы обновлений, которые реально обрабатывают хендлеры из setup_handlers
+# (CommandHandler/MessageHandler - message, CallbackQueryHandler - callback_query).
+# Telegram фильтрует остальные типы на своей стороне и не присылает их на вебхук
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
 
-async def start_webhook(application, base_url, port):
+async def start_webhook(application, webhook_url, port):
     """Запуск бота в режиме webhook"""
     try:
-        # Удаляем предыдущие вебхуки
-        await application.bot.delete_webhook(drop_pending_updates=True)
+        logger.info("Setting webhook to: %s", webhook_url)
         
-        # Формируем URL для вебхука
-        webhook_url = f"{base_url.rstrip('/')}/webhook/{TOKEN}"
-        logger.info(f"Setting webhook to: {webhook_url}")
+        # Инициализируем приложение (эти шаги должны идти по порядку)
+        await application.initialize()
+        await application.start()
         
-        # Устанавливаем вебхук
-        await application.bot.set_webhook(
-            url=webhook_url,
-            drop_pending_updates=True
+        # post_init и регистрация вебхука независимы - выполняем их параллельно.
+        # start_webhook сам вызывает setWebhook (заменяя предыдущий вебхук),
+        # отдельные delete/set не нужны
+        await asyncio.gather(
+            application.post_init(application),
+            application.updater.start_webhook(
+                listen='0.0.0.0',
+                port=port,
+                url_path=WEBHOOK_PATH,
+                webhook_url=webhook_url,
+                secret_token=WEBHOOK_SECRET,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=ALLOWED_UPDATES,
+                drop_pending_updates=True
+            )
         )
         
-        # Инициализируем приложение
+        logger.info("Webhook server started on port %s", port)
+        return True
+    except Exception as e:
+        logger.error("Error in start_webhook: %s", e, exc_info=True)
+        return False
+
+async def start_polling(application):
+    """Запуск бота в режиме long polling (только при FORCE_POLLING=1)"""
+    try:
         await application.initialize()
         await application.start()
         
-        # Настраиваем веб-сервер для webhook
-        await application.updater.start_webhook(
-            listen='0.0.0.0',
-            port=port,
-            url_path=f"webhook/{TOKEN}",
-            webhook_url=webhook_url,
-            drop_pending_updates=True
+        # start_polling сам удаляет вебхук перед первым getUpdates.
+        # Long polling: без паузы между запросами, Telegram держит getUpdates открытым до
+        # прихода обновлений (до TELEGRAM_LONG_POLL_TIMEOUT секунд) и отдает их пачкой,
+        # поэтому в простое бот делает ~1 запрос в таймаут вместо нескольких в секунду
+        await asyncio.gather(
+            application.post_init(application),
+            application.updater.start_polling(
+                poll_interval=0.0,
+                timeout=TELEGRAM_LONG_POLL_TIMEOUT,
+                bootstrap_retries=-1,
+                allowed_updates=ALLOWED_UPDATES,
+                drop_pending_updates=True
+            )
         )
         
-        logger.info(f"Webhook server started on port {port}")
+        logger.info("Polling started")
         return True
     except Exception as e:
-        logger.error(f"Error in start_webhook: {e}")
+        logger.error("Error in start_polling: %s", e, exc_info=True)
         return False
 
 async def main():
     """Главная функция запуска бота"""
     application = None
     cron_server = None
-    
+
+    # Обязательные настройки проверяются до создания приложения, HTTP-клиентов и подключения к БД
+    config_error = None
+    if not TOKEN:
+        config_error = "❌ BOT_TOKEN is not set"
+    elif not FORCE_POLLING and not WEBHOOK_URL:
+        config_error = "❌ PUBLIC_WEBHOOK_URL (or RENDER_EXTERNAL_URL) is not set, webhook cannot be configured"
+    if config_error:
+        BotLogger.setup_logging().critical(config_error)
+        BotLogger.shutdown_logging()
+        return
+
+    # Eager task factory (Python 3.12+) выполняет корутину обработчика сразу до первой
+    # реальной приостановки, без лишнего прохода планировщика
+    eager_task_factory = getattr(asyncio, 'eager_task_factory', None)
+    if eager_task_factory is not None:
+        asyncio.get_running_loop().set_task_factory(eager_task_factory)
+
+    logger.info("🔁 Event loop: %s", type(asyncio.get_running_loop()).__module__)
+
+    # Остановка по SIGTERM (Render) или SIGINT (Ctrl+C) через событие, без периодических пробуждений
+    stop_event = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            asyncio.get_running_loop().add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows: остается обработка KeyboardInterrupt
+            pass
+
     try:
         # Создаем экземпляр бота
         telegram_bot = TelegramBot()
         
-        # Создаем приложение
-        application = Application.builder().token(TOKEN).build()
+        # Пул HTTP-соединений к Bot API должен покрывать все параллельно обрабатываемые обновления
+        if TG_POOL_SIZE < CONCURRENT_UPDATES:
+            telegram_bot.logger.warning(
+                "⚠️ TG_POOL_SIZE=%s is less than CONCURRENT_UPDATES=%s", TG_POOL_SIZE, CONCURRENT_UPDATES
+            )
+        # HTTP/2 мультиплексирует множество мелких запросов к Bot API в одном TCP-соединении
+        bot_request = HTTPXRequest(
+            http_version="2",
+            connection_pool_size=TG_POOL_SIZE,
+            pool_timeout=TG_POOL_TIMEOUT,
+            connect_timeout=TG_CONNECT_TIMEOUT,
+            read_timeout=TG_READ_TIMEOUT,
+            write_timeout=TG_READ_TIMEOUT
+        )
+        # getUpdates получает собственный небольшой пул: его read_timeout рассчитан на long-poll,
+        # и ожидание опроса не должно занимать соединения исходящих запросов
+        get_updates_request = HTTPXRequest(
+            connection_pool_size=TG_GET_UPDATES_POOL_SIZE,
+            pool_timeout=TG_GET_UPDATES_POOL_TIMEOUT,
+            connect_timeout=TG_CONNECT_TIMEOUT
+        )
+        
+        # Создаем приложение. Вебхук отвечает Telegram сразу после постановки обновления
+        # в очередь, а concurrent_updates обрабатывает обновления отдельными задачами
+        # (не более CONCURRENT_UPDATES одновременно), чтобы медленный обработчик не задерживал остальные.
+        # AIMDRateLimiter (AIORateLimiter) ставит в очередь все запросы к Bot API (включая edit и answer)
+        # до того, как они займут соединение, повторяет их после 429 RetryAfter и уменьшает число
+        # одновременных запросов при 429. send_limiter в местах рассылок дополнительно
+        # выдерживает темп ~1 сообщение в секунду на чат.
+        application = Application.builder()\
+            .token(TOKEN)\
+            .concurrent_updates(CONCURRENT_UPDATES)\
+            .request(bot_request)\
+            .get_updates_request(get_updates_request)\
+            .rate_limiter(AIMDRateLimiter(overall_max_rate=30, overall_time_period=1, max_retries=3))\
+            .build()
         
         # Настраиваем обработчики
         telegram_bot.setup_handlers(application)
@@ -990,92 +1561,81 @@ async def main():
         application.post_init = telegram_bot.post_init
         application.post_shutdown = telegram_bot.cleanup
         
-        # Получаем URL приложения из переменных окружения
-        app_url = os.getenv('RENDER_EXTERNAL_URL')
+        # Периодическая аналитика: запросы к БД выполняются в пуле потоков БД,
+        # чтобы не блокировать цикл событий
+        if ANALYTICS_CHAT_ID:
+            schedule_analytics(application.job_queue)
         
         telegram_bot.logger.info("🚀 Starting telegram bot...")
         
-        # Определяем режим работы
-        if app_url and os.getenv('RENDER'):
-            # Режим webhook для Render
-            telegram_bot.logger.info("📡 Starting in webhook mode...")
-            
-            # Настройка порта для Render
-            port = int(os.getenv('PORT', '4000'))
-            telegram_bot.logger.info(f"🔌 Using port: {port}")
-            
-            # Формируем базовый URL для вебхука
-            base_url = app_url.rstrip('/')
-            telegram_bot.logger.info(f"🌐 Base URL: {base_url}")
-            
-            # Запускаем cron сервер для автоматических начислений
+        # По умолчанию бот работает через webhook: Telegram сам доставляет обновления,
+        # без постоянных запросов getUpdates. Polling - только по явному FORCE_POLLING=1
+        if FORCE_POLLING:
+            telegram_bot.logger.info("📡 Starting in polling mode (FORCE_POLLING=1)...")
+            if not await start_polling(application):
+                telegram_bot.logger.error("❌ Failed to start polling")
+                return
+            await stop_event.wait()
+            telegram_bot.logger.info("🛑 Bot stopped by signal")
+            return
+        
+        telegram_bot.logger.info("📡 Starting in webhook mode...")
+        telegram_bot.logger.info("🔌 Using port: %s", PORT)
+        telegram_bot.logger.info("🌐 Base URL: %s", PUBLIC_WEBHOOK_URL)
+        
+        # Самопинг только по ENABLE_SELF_PING=1: платформа сама держит сервис доступным,
+        # а лишние HTTPS-запросы каждые CRON_INTERVAL секунд не нужны
+        if ENABLE_SELF_PING:
             try:
-                cron_server = CronServer(app_url)
+                # Импорт здесь: без самопинга aiohttp при запуске не загружается
+                from utils.cron_server import CronServer
+                cron_server = CronServer(PUBLIC_WEBHOOK_URL, interval=CRON_INTERVAL)
                 await cron_server.start()
                 telegram_bot.logger.info("⏰ Cron server started")
             except Exception as e:
-                telegram_bot.logger.warning(f"⚠️ Failed to start cron server: {e}")
-            
-            # Запускаем webhook
-            telegram_bot.logger.info("🔄 Starting webhook...")
-            server_started = await start_webhook(application, base_url, port)
-            
-            if not server_started:
-                telegram_bot.logger.error("❌ Failed to start webhook server")
-                return
-                
-            telegram_bot.logger.info(f"✅ Webhook server started successfully on port {port}")
-            
-            # Бесконечный цикл для поддержания работы
-            try:
-                while True:
-                    await asyncio.sleep(3600)  # Проверяем каждый час
-            except KeyboardInterrupt:
-                telegram_bot.logger.info("🛑 Bot stopped by user")
-                
-        else:
-            # Режим long polling для локальной разработки
-            telegram_bot.logger.info("🔄 Starting in polling mode...")
-            
-            # Запускаем cron сервер (если нужен)
-            try:
-                if app_url:
-                    cron_server = CronServer(app_url)
-                    await cron_server.start()
-                    telegram_bot.logger.info("⏰ Cron server started")
-            except Exception as e:
-                telegram_bot.logger.warning(f"⚠️ Failed to start cron server: {e}")
+                telegram_bot.logger.warning("⚠️ Failed to start cron server: %s", e, exc_info=True)
+        
+        # Запускаем webhook
+        telegram_bot.logger.info("🔄 Starting webhook...")
+        server_started = await start_webhook(application, WEBHOOK_URL, PORT)
+        
+        if not server_started:
+            telegram_bot.logger.error("❌ Failed to start webhook server")
+            return
             
-            # Запускаем polling
-            await application.run_polling(
-                poll_interval=1.0,
-                timeout=10,
-                read_timeout=30,
-                write_timeout=30,
-                connect_timeout=30,
-                drop_pending_updates=True
-            )
+        telegram_bot.logger.info("✅ Webhook server started successfully on port %s", PORT)
+        
+        # Работаем до сигнала остановки
+        await stop_event.wait()
+        telegram_bot.logger.info("🛑 Bot stopped by signal")
         
     except KeyboardInterrupt:
         telegram_bot.logger.info("🛑 Bot stopped by user")
     except Exception as e:
-        telegram_bot.logger.critical(f"💥 Critical error in main: {e}")
+        telegram_bot.logger.critical("💥 Critical error in main: %s", e, exc_info=True)
         
         # Отправляем уведомление админам об ошибке
         if application:
-            error_message = f"""🚨 *КРИТИЧЕСКАЯ ОШИБКА БОТА* [WARNING]
-
-Бот остановлен из-за критической ошибки: {str(e)}"""
+            try:
+                bot_username = application.bot.username
+            except RuntimeError:
+                # Бот не успел инициализироваться (getMe не выполнялся)
+                bot_username = 'UnknownBot'
+            error_message = ADMIN_ERROR_TEMPLATE.format(
+                bot=html.escape(bot_username),
+                exc_type=type(e).__name__,
+                exc_msg=html.escape(str(e))
+            )
             
-            for admin_id in ADMIN_IDS:
-                try:
-                    await application.bot.send_message(
-                        chat_id=admin_id,
-                        text=error_message,
-                        parse_mode=ParseMode.MARKDOWN
-                    )
-                except Exception:
-                    pass
+            # notify_admins рассылает всем админам параллельно; общий таймаут не дает
+            # повторам после RetryAfter задержать остановку процесса
+            try:
+                await asyncio.wait_for(
+                    notify_admins(application.bot, error_message, parse_mode=ParseMode.HTML),
+                    timeout=CRASH_NOTIFY_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                telegram_bot.logger.error("Timed out notifying admins about the crash")
     
     finally:
         # Очистка ресурсов
@@ -1087,10 +1647,29 @@ async def main():
         
         if application:
             try:
-                await application.stop()
+                if application.updater.running:
+                    await application.updater.stop()
+                if application.running:
+                    await application.stop()
                 await application.shutdown()
+                await application.post_shutdown(application)
             except Exception:
                 pass
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    # uvloop - более быстрый цикл событий; на Windows и без пакета работаем на стандартном asyncio
+    try:
+        import uvloop
+    except ImportError:
+        uvloop = None
+    
+    if uvloop is None:
+        asyncio.run(main())
+    elif sys.version_info >= (3, 11):
+        # loop_factory вместо глобальной политики: политики циклов событий устаревают в Python 3.14
+        with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+            runner.run(main())
+    else:
+        # uvloop.install() объявлен устаревшим в новых версиях uvloop, поэтому задаем политику
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        asyncio.run(main())
@@ -13,7 +13,24 @@ __all__ = [
     'CHANNEL_LINK',
     'CHANNEL_NAME',
     'ANALYTICS_CHAT_ID',
+    'RENDER_EXTERNAL_URL',
+    'PUBLIC_WEBHOOK_URL',
+    'FORCE_POLLING',
     'WEBHOOK_ENABLED',
     'PORT',
-    'WEBHOOK_URL'
+    'WEBHOOK_PATH',
+    'WEBHOOK_URL',
+    'WEBHOOK_SECRET',
+    'WEBHOOK_MAX_CONNECTIONS',
+    'CONCURRENT_UPDATES',
+    'TG_POOL_SIZE',
+    'TG_POOL_TIMEOUT',
+    'TG_CONNECT_TIMEOUT',
+    'TG_READ_TIMEOUT',
+    'TG_GET_UPDATES_POOL_SIZE',
+    'TG_GET_UPDATES_POOL_TIMEOUT',
+    'TELEGRAM_LONG_POLL_TIMEOUT',
+    'DATABASE_POOL_SIZE',
+    'REDIS_URL',
+    'ENABLE_SELF_PING'
 ]
\ No newline at end of file
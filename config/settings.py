@@ -1,8 +1,15 @@
 import os
-from dotenv import load_dotenv
+import secrets
 
-# Загрузка конфигурации из .env файла
-load_dotenv()
+# Загрузка конфигурации из .env файла - только локально: на Render и в production-образах
+# переменные окружения задает платформа, и искать .env (и импортировать python-dotenv) незачем
+if not os.getenv('RENDER') and not os.getenv('PRODUCTION'):
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        pass
+    else:
+        load_dotenv(override=False)
 
 # 🔐 Основные настройки бота
 TOKEN = os.getenv('BOT_TOKEN')
@@ -35,7 +42,8 @@ INVESTMENT_PLANS = {
 }
 
 # 👑 Администраторы
-ADMIN_IDS = [int(id_) for id_ in os.getenv('ADMIN_IDS', '').split(',') if id_]
+# frozenset: проверка is_admin за O(1) и защита от случайного изменения списка
+ADMIN_IDS = frozenset(int(id_) for id_ in os.getenv('ADMIN_IDS', '').split(',') if id_.strip().isdigit())
 
 # 📢 Настройки канала
 CHANNEL_ID = os.getenv('CHANNEL_ID')
@@ -46,15 +54,47 @@ CHANNEL_NAME = os.getenv('CHANNEL_NAME')
 ANALYTICS_CHAT_ID = os.getenv('ANALYTICS_CHAT_ID')
 
 # 🌐 Настройки веб-сервера
+RENDER_EXTERNAL_URL = os.getenv('RENDER_EXTERNAL_URL')
+# Публичный адрес для вебхука вне Render (свой сервер, ngrok); на Render берется RENDER_EXTERNAL_URL
+PUBLIC_WEBHOOK_URL = os.getenv('PUBLIC_WEBHOOK_URL') or RENDER_EXTERNAL_URL
+# Long polling вместо вебхука - только по явному FORCE_POLLING=1 (локальная отладка без публичного адреса)
+FORCE_POLLING = os.getenv('FORCE_POLLING') == '1'
 WEBHOOK_ENABLED = bool(os.getenv('RENDER'))
 PORT = int(os.getenv('PORT', 3000))
-WEBHOOK_URL = f"{os.getenv('RENDER_EXTERNAL_URL')}/{TOKEN}" if WEBHOOK_ENABLED else None
+WEBHOOK_PATH = f"webhook/{TOKEN}"
+WEBHOOK_URL = f"{PUBLIC_WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}" if PUBLIC_WEBHOOK_URL else None
+# Секрет в заголовке X-Telegram-Bot-Api-Secret-Token: запросы без него отклоняются до разбора JSON.
+# Без WEBHOOK_SECRET генерируется при каждом запуске (вебхук все равно регистрируется заново)
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+# Максимум одновременных HTTPS-соединений Telegram к вебхуку (1-100, по умолчанию у Telegram 40)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 100))
+# Сколько обновлений обрабатывается параллельно
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', 64))
+# Пул HTTP-соединений для исходящих запросов к Bot API (send_message, answer и т.д.)
+TG_POOL_SIZE = int(os.getenv('TG_POOL_SIZE', 256))
+TG_POOL_TIMEOUT = float(os.getenv('TG_POOL_TIMEOUT', 20.0))
+TG_CONNECT_TIMEOUT = float(os.getenv('TG_CONNECT_TIMEOUT', 10.0))
+TG_READ_TIMEOUT = float(os.getenv('TG_READ_TIMEOUT', 20.0))
+# Отдельный пул для getUpdates: long-poll держит соединение до таймаута опроса
+# и не должен занимать соединения, нужные обработчикам
+TG_GET_UPDATES_POOL_SIZE = int(os.getenv('TG_GET_UPDATES_POOL_SIZE', 4))
+TG_GET_UPDATES_POOL_TIMEOUT = float(os.getenv('TG_GET_UPDATES_POOL_TIMEOUT', 40.0))
+# Сколько секунд Telegram держит getUpdates открытым в ожидании обновлений (long polling, FORCE_POLLING=1)
+TELEGRAM_LONG_POLL_TIMEOUT = int(os.getenv('TELEGRAM_LONG_POLL_TIMEOUT', 50))
 
 # 🗄️ Настройки базы данных
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///shop.db')
+# Размер пула соединений и пула потоков для блокирующих запросов к БД
+DATABASE_POOL_SIZE = int(os.getenv('DATABASE_POOL_SIZE', 5))
 DATABASE_BACKUP_DIR = 'backups'
 DATABASE_BACKUP_INTERVAL = 24  # часов
 
+# Общий кэш между процессами бота (redis://...); без него кэши только в памяти процесса
+REDIS_URL = os.getenv('REDIS_URL')
+
 # Настройки Cron сервера для render.com
 RENDER_APP_URL = os.getenv('RENDER_APP_URL', 'https://your-app-name.onrender.com')
-CRON_INTERVAL = int(os.getenv('CRON_INTERVAL', 600))  # 10 минут по умолчанию
\ No newline at end of file
+CRON_INTERVAL = int(os.getenv('CRON_INTERVAL', 600))  # 10 минут по умолчанию
+# Самопинг выключен по умолчанию: Render сам проверяет доступность сервиса.
+# ENABLE_SELF_PING=1 включает периодический GET на публичный адрес бота
+ENABLE_SELF_PING = os.getenv('ENABLE_SELF_PING') == '1'
\ No newline at end of file
@@ -1,4 +1,5 @@
-from datetime import datetime
+from functools import partial
+
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
@@ -6,7 +7,9 @@ from telegram.constants import ParseMode
 from config import ADMIN_IDS
 from utils.database import Database
 from utils.keyboards import Keyboards
-from utils.helpers import format_currency
+from utils.helpers import format_currency, format_now
+from utils.rate_limiter import send_limiter
+from services.notifications import fanout
 
 db = Database()
 
@@ -25,7 +28,7 @@ async def show_admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 ✅ Активных: *{stats['active_users']}*
 🚫 Заблокировано: *{stats['blocked_users']}*
 
-📅 {datetime.now().strftime('%d.%m.%Y %H:%M')}"""
+📅 {format_now('%d.%m.%Y %H:%M')}"""
 
     keyboard = [
         [InlineKeyboardButton("📊 Подробная статистика", callback_data='admin_stats'),
@@ -49,6 +52,28 @@ async def show_admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode=ParseMode.MARKDOWN
         )
 
+# Действия админ-панели, после которых ожидается текстовый ввод:
+# callback_data -> (состояние ожидания в user_data, подсказка)
+ADMIN_INPUT_PROMPTS = {
+    'admin_broadcast': ('broadcast_message', "📢 *Рассылка сообщения*\n\nВведите текст для рассылки:"),
+    'admin_block': ('user_id_to_block', "🚫 *Блокировка пользователя*\n\nВведите ID пользователя:"),
+    'admin_unblock': ('user_id_to_unblock', "✅ *Разблокировка пользователя*\n\nВведите ID пользователя:"),
+}
+
+async def prompt_admin_input(update: Update, context: ContextTypes.DEFAULT_TYPE, action: str):
+    """Запросить у админа ввод для действия action из ADMIN_INPUT_PROMPTS
+
+    Маршрутизатор вызывает эту функцию напрямую (через functools.partial),
+    поэтому повторно разбирать callback_data не нужно.
+    """
+    waiting_for, prompt = ADMIN_INPUT_PROMPTS[action]
+    context.user_data['waiting_for'] = waiting_for
+    await update.callback_query.edit_message_text(
+        text=prompt,
+        reply_markup=Keyboards.cancel_action('admin_panel'),
+        parse_mode=ParseMode.MARKDOWN
+    )
+
 async def handle_admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка команд админ-панели"""
     query = update.callback_query
@@ -58,51 +83,80 @@ async def handle_admin_command(update: Update, context: ContextTypes.DEFAULT_TYP
         await query.answer("❌ Недостаточно прав", show_alert=True)
         return
     
-    command = query.data
-    
-    if command == 'admin_stats':
-        stats = db.get_global_statistics()
-        stats_text = f"""📊 *СТАТИСТИКА БОТА*
-
-👥 Всего пользователей: *{stats['total_users']}*
-💰 Общий баланс: *{format_currency(stats['total_balance'])}*
-📈 Всего заработано: *{format_currency(stats['total_earned'])}*
-💸 Всего выведено: *{format_currency(stats['total_withdrawals'])}*
-📈 Всего инвестировано: *{format_currency(stats['total_investments'])}*
-💎 Общая прибыль: *{format_currency(stats['total_profit'])}*
-
-📅 Дата: {datetime.now().strftime('%d.%m.%Y %H:%M')}"""
-
-        keyboard = Keyboards.back_to_admin()
-        await query.edit_message_text(
-            text=stats_text,
-            reply_markup=keyboard,
+    if query.data in ADMIN_INPUT_PROMPTS:
+        await prompt_admin_input(update, context, query.data)
+
+async def _send_broadcast_message(context: ContextTypes.DEFAULT_TYPE, message: str, chat_id: int):
+    """Отправить сообщение рассылки одному пользователю с учетом лимитов Telegram"""
+    async with send_limiter.slot(chat_id):
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=message,
             parse_mode=ParseMode.MARKDOWN
         )
 
-    elif command == 'admin_broadcast':
-        context.user_data['waiting_for'] = 'broadcast_message'
-        await query.edit_message_text(
-            text="📢 *Рассылка сообщения*\n\nВведите текст для рассылки:",
-            reply_markup=Keyboards.cancel_action('admin_panel'),
-            parse_mode=ParseMode.MARKDOWN
-        )
-    
-    elif command == 'admin_block':
-        context.user_data['waiting_for'] = 'user_id_to_block'
-        await query.edit_message_text(
-            text="🚫 *Блокировка пользователя*\n\nВведите ID пользователя:",
-            reply_markup=Keyboards.cancel_action('admin_panel'),
-            parse_mode=ParseMode.MARKDOWN
+async def _broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE, message: str):
+    """Отправка сообщения всем пользователям"""
+    success = 0
+    failed = 0
+    # ID читаются пачками, а не всей таблицей объектов User; внутри пачки сообщения
+    # отправляются параллельно, чтобы время рассылки не складывалось из RTT каждой отправки
+    send = partial(_send_broadcast_message, context, message)
+    for user_ids in db.iter_user_id_batches():
+        failed_ids = await fanout(user_ids, send)
+        failed += len(failed_ids)
+        success += len(user_ids) - len(failed_ids)
+
+    stats = db.get_user_statistics()
+    result = f"""📢 *Результаты рассылки*
+
+✅ Успешно отправлено: *{success}*
+❌ Ошибок отправки: *{failed}*
+📊 Всего пользователей: *{stats['total_users']}*"""
+
+    await update.message.reply_text(
+        text=result,
+        reply_markup=Keyboards.back_to_admin(),
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+async def _set_user_blocked(update: Update, context: ContextTypes.DEFAULT_TYPE, message: str, blocked: bool):
+    """Блокировка или разблокировка пользователя по введенному ID"""
+    try:
+        target_id = int(message)
+    except ValueError:
+        await update.message.reply_text(
+            "❌ Неверный формат ID",
+            reply_markup=Keyboards.back_to_admin()
         )
+        return
     
-    elif command == 'admin_unblock':
-        context.user_data['waiting_for'] = 'user_id_to_unblock'
-        await query.edit_message_text(
-            text="✅ *Разблокировка пользователя*\n\nВведите ID пользователя:",
-            reply_markup=Keyboards.cancel_action('admin_panel'),
-            parse_mode=ParseMode.MARKDOWN
+    user = db.get_user(target_id)
+    if not user:
+        await update.message.reply_text(
+            "❌ Пользователь не найден",
+            reply_markup=Keyboards.back_to_admin()
         )
+        return
+
+    if blocked:
+        db.block_user(target_id)
+        action = "заблокирован"
+    else:
+        db.unblock_user(target_id)
+        action = "разблокирован"
+
+    await update.message.reply_text(
+        f"✅ Пользователь {target_id} успешно {action}",
+        reply_markup=Keyboards.back_to_admin()
+    )
+
+# Обработчики ввода по состоянию ожидания из ADMIN_INPUT_PROMPTS
+_ADMIN_INPUT_HANDLERS = {
+    'broadcast_message': _broadcast,
+    'user_id_to_block': partial(_set_user_blocked, blocked=True),
+    'user_id_to_unblock': partial(_set_user_blocked, blocked=False),
+}
 
 async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка текстовых сообщений для админ-команд"""
@@ -111,70 +165,11 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
     if user_id not in ADMIN_IDS:
         return
     
-    waiting_for = context.user_data.get('waiting_for')
-    if not waiting_for:
+    handler = _ADMIN_INPUT_HANDLERS.get(context.user_data.get('waiting_for'))
+    if handler is None:
         return
-
-    message = update.message.text
-    
-    if waiting_for == 'broadcast_message':
-        # Отправка сообщения всем пользователям
-        success = 0
-        failed = 0
-        users = db.get_all_users()
-        
-        for user in users:
-            try:
-                await context.bot.send_message(
-                    chat_id=user.user_id,
-                    text=message,
-                    parse_mode=ParseMode.MARKDOWN
-                )
-                success += 1
-            except Exception:
-                failed += 1
-
-        stats = db.get_user_statistics()
-        result = f"""📢 *Результаты рассылки*
-
-✅ Успешно отправлено: *{success}*
-❌ Ошибок отправки: *{failed}*
-📊 Всего пользователей: *{stats['total_users']}*"""
-
-        await update.message.reply_text(
-            text=result,
-            reply_markup=Keyboards.back_to_admin(),
-            parse_mode=ParseMode.MARKDOWN
-        )
-    
-    elif waiting_for in ['user_id_to_block', 'user_id_to_unblock']:
-        try:
-            target_id = int(message)
-            user = db.get_user(target_id)
-            
-            if not user:
-                await update.message.reply_text(
-                    "❌ Пользователь не найден",
-                    reply_markup=Keyboards.back_to_admin()
-                )
-                return
-
-            if waiting_for == 'user_id_to_block':
-                db.block_user(target_id)
-                action = "заблокирован"
-            else:
-                db.unblock_user(target_id)
-                action = "разблокирован"
-
-            await update.message.reply_text(
-                f"✅ Пользователь {target_id} успешно {action}",
-                reply_markup=Keyboards.back_to_admin()
-            )
-        
-        except ValueError:
-            await update.message.reply_text(
-                "❌ Неверный формат ID",
-                reply_markup=Keyboards.back_to_admin()
-            )
     
-    del context.user_data['waiting_for']
\ No newline at end of file
+    try:
+        await handler(update, context, update.message.text)
+    finally:
+        del context.user_data['waiting_for']
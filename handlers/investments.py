@@ -1,4 +1,6 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
 from telegram.ext import ContextTypes
 from utils.database import Database
 from models.user import User, Investment
@@ -116,6 +118,10 @@ class InvestmentService:
         active_investments = [inv for inv in user.investments if not inv.is_finished]
         completed_investments = [inv for inv in user.investments if inv.is_finished]
         
+        # Отдельного поля с суммой вложений у пользователя нет - считаем ее в БД
+        total_invested = self.db.session.query(func.coalesce(func.sum(Investment.amount), 0))\
+            .filter(Investment.user_id == user.id)\
+            .scalar()
         total_profit = sum(inv.current_profit for inv in user.investments)
         daily_income = sum(
             inv.amount * inv.daily_profit 
@@ -123,7 +129,7 @@ class InvestmentService:
         )
         
         return {
-            'total_invested': user.total_invested,
+            'total_invested': total_invested,
             'total_profit': total_profit,
             'daily_income': daily_income,
             'active_investments': active_investments,
@@ -131,7 +137,7 @@ class InvestmentService:
             'active_count': len(active_investments),
             'completed_count': len(completed_investments),
             'has_investments': len(user.investments) > 0,
-            'roi_percentage': (total_profit / user.total_invested * 100) if user.total_invested > 0 else 0
+            'roi_percentage': (total_profit / total_invested * 100) if total_invested > 0 else 0
         }
     
     def _empty_stats(self) -> Dict[str, Any]:
@@ -179,8 +185,12 @@ class InvestmentService:
         
         return {'valid': True}
     
-    def create_investment(self, user_id: int, plan_type: str, amount: int) -> Dict[str, Any]:
-        """Создать новую инвестицию"""
+    async def create_investment(self, user_id: int, plan_type: str, amount: int) -> Dict[str, Any]:
+        """Создать новую инвестицию
+
+        Запись выполняется в отдельной сессии в пуле потоков БД (см. Database.run_in_session),
+        а не в общей сессии, которую делят все обработчики.
+        """
         validation = self.validate_investment(user_id, plan_type, amount)
         if not validation['valid']:
             return {'success': False, 'error': validation['error']}
@@ -189,37 +199,54 @@ class InvestmentService:
         plan = InvestmentConfig.get_plan(plan_type)
         
         try:
-            # Создаем инвестицию
-            investment = Investment(
-                user_id=user.id,
-                plan_type=plan_type,
-                amount=amount,
-                daily_profit=plan.daily_profit,
-                start_date=datetime.now(),
-                end_date=datetime.now() + timedelta(days=plan.duration_days)
-            )
-            
-            # Обновляем баланс пользователя
-            user.balance -= amount
-            user.total_invested += amount
-            user.investments.append(investment)
-            
-            self.db.session.add(investment)
-            self.db.session.commit()
-            
-            logger.info(f"Investment created: user_id={user_id}, plan={plan_type}, amount={amount}")
-            
-            return {
-                'success': True,
-                'investment': investment,
-                'plan': plan,
-                'expected_profit': amount * plan.daily_profit * plan.duration_days
-            }
-            
+            investment = await self.db.run_in_session(self._create_investment_sync, user.id, plan_type, amount)
         except Exception as e:
-            logger.error(f"Error creating investment: {e}")
-            self.db.session.rollback()
+            logger.error("Error creating investment: %s", e)
             return {'success': False, 'error': 'Произошла ошибка при создании инвестиции'}
+        
+        if investment is None:
+            # Баланс успел уменьшиться между проверкой и списанием
+            return {'success': False, 'error': '💸 Недостаточно средств'}
+        
+        # Баланс и список инвестиций пользователя изменились в другой сессии
+        self.db.expire(User, user.id)
+        logger.info("Investment created: user_id=%s, plan=%s, amount=%s", user_id, plan_type, amount)
+        
+        return {
+            'success': True,
+            'investment': investment,
+            'plan': plan,
+            'expected_profit': amount * plan.daily_profit * plan.duration_days
+        }
+    
+    @staticmethod
+    def _create_investment_sync(session: Session, user_pk: int, plan_type: str, amount: int) -> Optional[Investment]:
+        """Списать сумму с баланса и создать инвестицию в одной транзакции
+
+        Списание - условный UPDATE, поэтому баланс не уходит в минус при параллельных запросах;
+        при нехватке средств возвращает None.
+        """
+        debited = session.execute(
+            update(User)
+            .where(User.id == user_pk, User.balance >= amount)
+            .values(balance=User.balance - amount)
+        ).rowcount
+        if debited != 1:
+            return None
+        
+        plan = InvestmentConfig.get_plan(plan_type)
+        now = datetime.now()
+        investment = Investment(
+            user_id=user_pk,
+            plan_type=plan_type,
+            amount=amount,
+            daily_profit=plan.daily_profit,
+            start_date=now,
+            end_date=now + timedelta(days=plan.duration_days)
+        )
+        session.add(investment)
+        session.flush()
+        return investment
     
     def calculate_profit(self, amount: int, plan_type: str) -> Dict[str, float]:
         """Рассчитать прибыль для суммы и плана"""
@@ -322,10 +349,11 @@ class InvestmentMessageBuilder:
         
         if stats['active_investments']:
             text_parts.append("\n*🔥 АКТИВНЫЕ ИНВЕСТИЦИИ:*")
+            now = datetime.now()
             for inv in stats['active_investments'][:5]:  # Показываем только первые 5
                 plan = InvestmentConfig.get_plan(inv.plan_type)
                 if plan:
-                    days_left = (inv.end_date - datetime.now()).days
+                    days_left = (inv.end_date - now).days
                     text_parts.append(
                         f"{plan.emoji} {plan.name}: {inv.amount:,}₽ "
                         f"(+{inv.current_profit:,}₽) • {days_left}д"
@@ -444,7 +472,7 @@ async def show_investments(update: Update, context: ContextTypes.DEFAULT_TYPE) -
                 parse_mode='Markdown'
             )
     except Exception as e:
-        logger.error(f"Error in show_investments: {e}")
+        logger.error("Error in show_investments: %s", e)
         await _send_error_message(update, "Ошибка при загрузке инвестиций")
 
 async def handle_investment_request(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -469,7 +497,7 @@ async def handle_investment_request(update: Update, context: ContextTypes.DEFAUL
             await _handle_unknown_request(query)
             
     except Exception as e:
-        logger.error(f"Error in handle_investment_request: {e}")
+        logger.error("Error in handle_investment_request: %s", e)
         await _send_error_message(query, "Произошла ошибка при обработке запроса")
 
 # Вспомогательные функции
@@ -507,7 +535,7 @@ async def _handle_plan_selection(query) -> None:
 async def _handle_amount_selection(query) -> None:
     """Обработать выбор суммы инвестиции"""
     try:
-        parts = query.data.split('_')
+        parts = query.data.split('_', 3)
         plan_type = parts[2]
         amount = int(parts[3])
     except (IndexError, ValueError):
@@ -544,7 +572,7 @@ async def _handle_amount_selection(query) -> None:
 async def _handle_investment_confirmation(query) -> None:
     """Обработать подтверждение инвестиции"""
     try:
-        parts = query.data.split('_')
+        parts = query.data.split('_', 3)
         plan_type = parts[2]
         amount = int(parts[3])
     except (IndexError, ValueError):
@@ -552,7 +580,7 @@ async def _handle_investment_confirmation(query) -> None:
         return
     
     service = InvestmentService()
-    result = service.create_investment(query.from_user.id, plan_type, amount)
+    result = await service.create_investment(query.from_user.id, plan_type, amount)
     
     if result['success']:
         text = InvestmentMessageBuilder.build_success_text(
@@ -622,7 +650,7 @@ async def _send_error_message(update_or_query, error_text: str) -> None:
     keyboard = InvestmentKeyboardBuilder.build_back_keyboard('investments')
     text = f"❌ *ОШИБКА*\n\n{error_text}"
     
-    if hasattr(update_or_query, 'callback_query'):
+    if isinstance(update_or_query, Update):
         await update_or_query.callback_query.edit_message_text(
             text=text,
             reply_markup=keyboard,
@@ -7,11 +7,14 @@ from config.settings import REFERRAL_BONUS
 from utils.keyboards import Keyboards
 from utils.database import Database
 from utils.helpers import format_currency, plural_form
+from utils.rate_limiter import send_limiter
 
 # ... existing code ...
 
 db = Database()
 
+_REFERRAL_BONUS_TEXT = format_currency(REFERRAL_BONUS)
+
 async def show_referral_program(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать реферальную статистику и ссылку"""
     query = update.callback_query
@@ -26,7 +29,7 @@ async def show_referral_program(update: Update, context: ContextTypes.DEFAULT_TY
     
     ref_text = f"""👥 *Реферальная программа*
 
-💰 Приглашайте друзей и получайте *{format_currency(REFERRAL_BONUS)}* за каждого!
+💰 Приглашайте друзей и получайте *{_REFERRAL_BONUS_TEXT}* за каждого!
 
 🔗 *Ваша реферальная ссылка:*
 `{ref_link}`
@@ -63,11 +66,11 @@ async def handle_referral_bonus(update: Update, context: ContextTypes.DEFAULT_TY
             
             # Отправляем уведомление рефереру
             try:
-                await context.bot.send_message(
-                    chat_id=referrer_id,
-                    text=f"🎉 Поздравляем! По вашей ссылке зарегистрировался новый пользователь.\n"
-                         f"💰 Вам начислен бонус: {format_currency(REFERRAL_BONUS)}",
-                    parse_mode=ParseMode.MARKDOWN
-                )
+                async with send_limiter.slot(referrer_id):
+                    await context.bot.send_message(
+                        chat_id=referrer_id,
+                        text=f"🎉 Поздравляем! По вашей ссылке зарегистрировался новый пользователь.\n"
+                             f"💰 Вам начислен бонус: {_REFERRAL_BONUS_TEXT}"
+                    )
             except Exception as e:
                 logging.error(f"Error sending referral bonus notification: {e}")
@@ -1,44 +1,100 @@
+import asyncio
 import logging
 from datetime import datetime
+from typing import Any, Dict
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
 from telegram import Update, ChatMember, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
 from telegram.error import TelegramError
 
-from config.settings import CHANNEL_ID, ADMIN_IDS, REFERRAL_BONUS
+from config.settings import CHANNEL_ID, ADMIN_IDS, REFERRAL_BONUS, REDIS_URL
 from utils.helpers import format_currency
+from utils.rate_limiter import send_limiter
 from utils.keyboards import Keyboards
+from utils.cache import SharedFlagCache, TTLCache
 from utils.database import Database
-from models.user import User
+from models.user import User, Referral, Investment
 
 # ... existing code ...
+logger = logging.getLogger(__name__)
+
 db = Database()
 
-async def check_channel_subscription(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> bool:
-    """Проверка подписки пользователя на канал"""
+# Статические тексты и суммы из настроек собираются один раз при импорте
+_REFERRAL_BONUS_TEXT = format_currency(REFERRAL_BONUS)
+_CHANNEL_CHECK_TEXT = "🔒 Для использования бота необходимо подписаться на наш канал"
+
+# Результаты проверки подписки: подписка запоминается на 5 минут, ее отсутствие - на 15 секунд,
+# чтобы только что подписавшийся пользователь не ждал долго
+SUBSCRIBED_TTL = 300
+NOT_SUBSCRIBED_TTL = 15
+_subscription_cache = TTLCache(maxsize=50_000, ttl=SUBSCRIBED_TTL)
+# Второй уровень для нескольких процессов бота (если задан REDIS_URL)
+_shared_subscription_cache = SharedFlagCache(REDIS_URL, 'sub')
+# Запросы getChatMember в процессе: параллельные проверки одного пользователя ждут один ответ
+_subscription_inflight: Dict[int, 'asyncio.Future[bool]'] = {}
+
+async def check_channel_subscription(context: ContextTypes.DEFAULT_TYPE, user_id: int, force: bool = False) -> bool:
+    """Проверка подписки пользователя на канал
+
+    Ответ getChatMember кэшируется; force=True запрашивает Telegram заново
+    (кнопка "Проверить подписку"). Если запрос для пользователя уже выполняется,
+    результат берется из него.
+    """
+    if not force:
+        cached = _subscription_cache.get(user_id)
+        if cached is not None:
+            return cached
+    
+    inflight = _subscription_inflight.get(user_id)
+    if inflight is not None:
+        # shield: отмена одного ожидающего не должна отменять общий запрос
+        return await asyncio.shield(inflight)
+    
+    future = asyncio.ensure_future(_fetch_channel_subscription(context, user_id, force))
+    _subscription_inflight[user_id] = future
+    future.add_done_callback(lambda _: _subscription_inflight.pop(user_id, None))
+    return await asyncio.shield(future)
+
+async def _fetch_channel_subscription(context: ContextTypes.DEFAULT_TYPE, user_id: int, force: bool) -> bool:
+    """Запросить подписку у Telegram и закэшировать ответ (ошибки не кэшируются)
+
+    Без force сначала проверяется общий кэш: ответ, полученный другим процессом, не запрашивается повторно.
+    """
+    if not force:
+        shared = await _shared_subscription_cache.get(user_id)
+        if shared is not None:
+            _subscription_cache.set(user_id, shared, None if shared else NOT_SUBSCRIBED_TTL)
+            return shared
+    
     try:
         member = await context.bot.get_chat_member(chat_id=CHANNEL_ID, user_id=user_id)
-        return member.status in [ChatMember.MEMBER, ChatMember.ADMINISTRATOR, ChatMember.OWNER]
+        is_subscribed = member.status in [ChatMember.MEMBER, ChatMember.ADMINISTRATOR, ChatMember.OWNER]
     except TelegramError as e:
-        print(f"Ошибка проверки подписки для пользователя {user_id}: {e}")
+        logger.warning("Ошибка проверки подписки для пользователя %s: %s", user_id, e)
         return False
+    
+    ttl = SUBSCRIBED_TTL if is_subscribed else NOT_SUBSCRIBED_TTL
+    _subscription_cache.set(user_id, is_subscribed, ttl)
+    await _shared_subscription_cache.set(user_id, is_subscribed, ttl)
+    return is_subscribed
 
 async def show_channel_check(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать экран проверки подписки на канал"""
     keyboard = Keyboards.channel_check()
-    message_text = "🔒 Для использования бота необходимо подписаться на наш канал"
     
     if update.callback_query:
         await update.callback_query.edit_message_text(
-            text=message_text,
-            reply_markup=keyboard,
-            parse_mode=ParseMode.MARKDOWN
+            text=_CHANNEL_CHECK_TEXT,
+            reply_markup=keyboard
         )
     else:
         await update.message.reply_text(
-            text=message_text,
-            reply_markup=keyboard,
-            parse_mode=ParseMode.MARKDOWN
+            text=_CHANNEL_CHECK_TEXT,
+            reply_markup=keyboard
         )
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -70,12 +126,12 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 db.session.commit()
                 # Отправляем уведомление рефереру
                 try:
-                    await context.bot.send_message(
-                        chat_id=ref_id,
-                        text=f"🎉 Поздравляем! По вашей ссылке зарегистрировался новый пользователь.\n"
-                             f"💰 Вам начислен бонус: {format_currency(REFERRAL_BONUS)}",
-                        parse_mode=ParseMode.MARKDOWN
-                    )
+                    async with send_limiter.slot(ref_id):
+                        await context.bot.send_message(
+                            chat_id=ref_id,
+                            text=f"🎉 Поздравляем! По вашей ссылке зарегистрировался новый пользователь.\n"
+                                 f"💰 Вам начислен бонус: {_REFERRAL_BONUS_TEXT}"
+                        )
                 except Exception as e:
                     logging.error(f"Error sending referral bonus notification: {e}")
 
@@ -142,6 +198,24 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await show_channel_check(update, context)
     # Остальные команды обрабатываются в соответствующих модулях
 
+def _balance_stats(session: Session, user_pk: int) -> Dict[str, Any]:
+    """Агрегаты для экрана баланса одним запросом (выполняется в пуле потоков БД)"""
+    investments = select(Investment).where(Investment.user_id == user_pk).subquery()
+    row = session.execute(select(
+        select(func.count()).where(investments.c.is_finished == False).scalar_subquery(),
+        select(func.coalesce(func.sum(investments.c.amount), 0)).scalar_subquery(),
+        select(func.coalesce(func.sum(investments.c.current_profit), 0)).scalar_subquery(),
+        select(func.coalesce(func.sum(Referral.bonus_paid), 0))
+            .where(Referral.referrer_id == user_pk)
+            .scalar_subquery()
+    )).one()
+    return {
+        'active_investments': row[0],
+        'total_invested': row[1],
+        'total_profit': row[2],
+        'referral_earnings': row[3]
+    }
+
 async def show_balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показывает баланс пользователя"""
     query = update.callback_query
@@ -156,22 +230,18 @@ async def show_balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not user:
         if query:
             await query.edit_message_text(
-                text="❌ Пользователь не найден. Пожалуйста, начните с /start.",
-                parse_mode=ParseMode.MARKDOWN
+                text="❌ Пользователь не найден. Пожалуйста, начните с /start."
             )
         else:
             await update.message.reply_text(
-                "❌ Пользователь не найден. Пожалуйста, начните с /start.",
-                parse_mode=ParseMode.MARKDOWN
+                "❌ Пользователь не найден. Пожалуйста, начните с /start."
             )
         return
 
-    # Получаем статистику инвестиций
-    active_investments = [inv for inv in user.investments if not inv.is_finished]
-    total_profit = sum(inv.current_profit for inv in user.investments)
-    referral_earnings = sum(ref.bonus_paid for ref in user.referrals)
+    # Статистика инвестиций и рефералов считается в БД, коллекции пользователя не загружаются
+    stats = await db.run_in_session(_balance_stats, user.id)
 
-    text = f"""💰 *Ваш баланс*: {user.balance}₽\n\n📈 *Инвестиции*:\n├ Активных: {len(active_investments)}\n├ Всего вложено: {user.total_invested}₽\n└ Общий доход: {total_profit}₽\n\n👥 *Рефералы*:\n└ Заработано: {referral_earnings}₽"""
+    text = f"""💰 *Ваш баланс*: {user.balance}₽\n\n📈 *Инвестиции*:\n├ Активных: {stats['active_investments']}\n├ Всего вложено: {stats['total_invested']}₽\n└ Общий доход: {stats['total_profit']}₽\n\n👥 *Рефералы*:\n└ Заработано: {stats['referral_earnings']}₽"""
 
     keyboard = [[InlineKeyboardButton("« Назад", callback_data='menu')]]
     if query:
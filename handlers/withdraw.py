@@ -3,13 +3,16 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
 
-from config import MIN_WITHDRAW, ADMIN_IDS
+from config import MIN_WITHDRAW
 from utils.keyboards import Keyboards
 from utils.database import Database
 from utils.helpers import format_currency, validate_amount, validate_payment_details
+from services.notifications import schedule_admin_notification
 
 db = Database()
 
+_MIN_WITHDRAW_TEXT = format_currency(MIN_WITHDRAW)
+
 async def handle_withdraw_request(update: Update, context: ContextTypes.DEFAULT_TYPE, amount: int = None):
     """Обработка запроса на вывод средств"""
     query = update.callback_query
@@ -18,8 +21,7 @@ async def handle_withdraw_request(update: Update, context: ContextTypes.DEFAULT_
     
     if not user:
         await query.edit_message_text(
-            text="❌ Пользователь не найден. Пожалуйста, начните с /start.",
-            parse_mode=ParseMode.MARKDOWN
+            text="❌ Пользователь не найден. Пожалуйста, начните с /start."
         )
         return
 
@@ -48,7 +50,7 @@ async def handle_withdraw_request(update: Update, context: ContextTypes.DEFAULT_
         withdraw_text = f"""❌ *Недостаточно средств*
 
 💰 Ваш баланс: *{format_currency(user.balance)}*
-💳 Минимум для вывода: *{format_currency(MIN_WITHDRAW)}*
+💳 Минимум для вывода: *{_MIN_WITHDRAW_TEXT}*
 📉 Не хватает: *{format_currency(needed)}*
 
 🚀 *Как быстро заработать:*
@@ -63,7 +65,7 @@ async def handle_withdraw_request(update: Update, context: ContextTypes.DEFAULT_
 📈 Всего заработано: *{format_currency(user.total_earned)}*
 💸 Выведено: *{format_currency(user.withdrawals)}*
 
-ℹ️ Минимальная сумма: *{format_currency(MIN_WITHDRAW)}*
+ℹ️ Минимальная сумма: *{_MIN_WITHDRAW_TEXT}*
 ⚡️ Срок обработки: до 24 часов
 🔒 Транзакции защищены
 
@@ -83,7 +85,7 @@ async def process_withdrawal(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     if data.startswith('confirm_withdraw_'):
         # Обработка подтверждения суммы
-        amount = float(data.split('_')[-1])
+        amount = float(data.rpartition('_')[2])
         user = db.get_user(user_id)
         
         if amount > user.balance:
@@ -91,7 +93,7 @@ async def process_withdrawal(update: Update, context: ContextTypes.DEFAULT_TYPE)
             return
         
         if amount < MIN_WITHDRAW:
-            await query.answer(f"❌ Минимальная сумма {format_currency(MIN_WITHDRAW)}", show_alert=True)
+            await query.answer(f"❌ Минимальная сумма {_MIN_WITHDRAW_TEXT}", show_alert=True)
             return
         
         # Показываем методы оплаты
@@ -110,7 +112,7 @@ async def process_withdrawal(update: Update, context: ContextTypes.DEFAULT_TYPE)
         
     elif data.startswith('payment_'):
         # Обработка выбора метода оплаты
-        _, method, amount = data.split('_')
+        _, method, amount = data.split('_', 2)
         amount = float(amount)
         
         context.user_data['withdraw'] = {
@@ -208,15 +210,7 @@ async def notify_admins_withdrawal(context: ContextTypes.DEFAULT_TYPE, user_id:
 🆔 Номер заявки: `{withdrawal.id}`
 📅 Дата: {withdrawal.date.strftime('%d.%m.%Y %H:%M')}"""
 
-    keyboard = Keyboards.admin_withdrawal_actions(withdrawal.id)
+    keyboard = Keyboards.admin_action_withdraw(withdrawal.id)
     
-    for admin_id in ADMIN_IDS:
-        try:
-            await context.bot.send_message(
-                chat_id=admin_id,
-                text=admin_text,
-                reply_markup=keyboard,
-                parse_mode=ParseMode.MARKDOWN
-            )
-        except Exception as e:
-            print(f"Ошибка отправки уведомления админу {admin_id}: {e}")
\ No newline at end of file
+    # Отправка идет задачей JobQueue с повторами для админов, до которых уведомление не дошло
+    schedule_admin_notification(context.job_queue, admin_text, keyboard)
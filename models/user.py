@@ -1,6 +1,6 @@
 from datetime import datetime
 from typing import List, Optional
-from sqlalchemy import Column, Integer, Float, String, Boolean, DateTime, ForeignKey, JSON
+from sqlalchemy import Column, Integer, Float, String, Boolean, DateTime, ForeignKey, Index, JSON
 from sqlalchemy.orm import relationship, Mapped
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -25,6 +25,12 @@ class User(Base):
     investments = relationship("Investment", back_populates="user")
     withdrawal_requests = relationship("WithdrawalRequest", back_populates="user")
 
+    # Рейтинг: ORDER BY total_earned DESC, balance DESC LIMIT 10 читает первые строки индекса
+    # вместо сортировки всей таблицы
+    __table_args__ = (
+        Index('ix_users_total_earned_balance', total_earned.desc(), balance.desc()),
+    )
+
     def __repr__(self):
         return f"<User(user_id={self.user_id}, balance={self.balance})>"
 
@@ -78,4 +84,11 @@ class WithdrawalRequest(Base):
     processed_date = Column(DateTime, nullable=True)
     processed_by = Column(Integer, nullable=True)  # admin_id
 
-    user = relationship("User", back_populates="withdrawal_requests")
\ No newline at end of file
+    user = relationship("User", back_populates="withdrawal_requests")
+
+    # История выводов пользователя: фильтр по user_id и сортировка по дате идут по индексу.
+    # Подсчет заявок по статусу (аналитика, админ-панель) читает только индекс status
+    __table_args__ = (
+        Index('ix_withdrawal_requests_user_id_date', user_id, date.desc()),
+        Index('ix_withdrawal_requests_status', status),
+    )
\ No newline at end of file
@@ -0,0 +1,84 @@
+import logging
+from typing import Any, Dict
+
+from sqlalchemy import func, case
+from sqlalchemy.orm import Session
+from telegram.ext import ContextTypes, JobQueue
+from telegram.constants import ParseMode
+
+from config.settings import ANALYTICS_CHAT_ID
+from utils.database import Database
+from utils.helpers import format_currency, format_now
+from utils.rate_limiter import send_limiter
+from models.user import User, WithdrawalRequest
+
+logger = logging.getLogger(__name__)
+
+# Базовый и максимальный интервал отчетов (сек). Пока статистика не меняется,
+# интервал удваивается до максимума, при изменениях возвращается к базовому
+ANALYTICS_INTERVAL = 300
+ANALYTICS_MAX_INTERVAL = 1800
+
+def _compute_analytics_sync(session: Session) -> Dict[str, Any]:
+    """Сбор статистики для отчёта (блокирующие запросы к БД, выполняется через Database.run_in_session)"""
+    total_users, active_users, blocked_users, total_balance = session.query(
+        func.count(User.id),
+        func.count(case((User.channel_joined == True, 1))),
+        func.count(case((User.is_blocked == True, 1))),
+        func.coalesce(func.sum(User.balance), 0)
+    ).one()
+    pending_withdrawals = session.query(func.count(WithdrawalRequest.id))\
+        .filter(WithdrawalRequest.status == 'pending')\
+        .scalar()
+
+    return {
+        'total_users': total_users,
+        'active_users': active_users,
+        'blocked_users': blocked_users,
+        'total_balance': total_balance,
+        'pending_withdrawals': pending_withdrawals
+    }
+
+def _build_analytics_message(stats: Dict[str, Any]) -> str:
+    """Построить текст отчёта"""
+    return f"""📊 *АНАЛИТИКА БОТА*
+
+👥 Пользователей: *{stats['total_users']:,}*
+✅ Активных: *{stats['active_users']:,}*
+🚫 Заблокировано: *{stats['blocked_users']:,}*
+💰 Общий баланс: *{format_currency(stats['total_balance'])}*
+⏳ Заявок на вывод: *{stats['pending_withdrawals']:,}*
+
+🕐 {format_now()}"""
+
+def schedule_analytics(job_queue: JobQueue, first: float = 10) -> None:
+    """Запланировать первый отчет; дальше send_analytics сам выбирает время следующего"""
+    state = {'interval': ANALYTICS_INTERVAL, 'last_stats': None}
+    job_queue.run_once(send_analytics, when=first, data=state)
+
+async def send_analytics(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Отправка аналитики в ANALYTICS_CHAT_ID
+
+    Состояние (текущий интервал, прошлая статистика) передается через job.data;
+    в цикле событий остается только отправка сообщения.
+    """
+    state = context.job.data
+    try:
+        stats = await Database().run_in_session(_compute_analytics_sync)
+        if stats == state['last_stats']:
+            # Новых данных нет - не повторяем отчет и просыпаемся реже
+            state['interval'] = min(state['interval'] * 2, ANALYTICS_MAX_INTERVAL)
+        else:
+            state['interval'] = ANALYTICS_INTERVAL
+            state['last_stats'] = stats
+            async with send_limiter.slot(ANALYTICS_CHAT_ID):
+                await context.bot.send_message(
+                    chat_id=ANALYTICS_CHAT_ID,
+                    text=_build_analytics_message(stats),
+                    parse_mode=ParseMode.MARKDOWN,
+                    disable_notification=True
+                )
+    except Exception as e:
+        logger.error("Error sending analytics: %s", e, exc_info=True)
+    finally:
+        context.job_queue.run_once(send_analytics, when=state['interval'], data=state)
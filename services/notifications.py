@@ -0,0 +1,91 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Iterable, List, Optional
+
+from telegram import Bot, InlineKeyboardMarkup
+from telegram.constants import ParseMode
+from telegram.ext import ContextTypes, JobQueue
+
+from config.settings import ADMIN_IDS
+from utils.rate_limiter import send_limiter
+
+logger = logging.getLogger(__name__)
+
+# Повторы неудавшихся уведомлений: пауза перед первым повтором (сек), дальше удваивается
+NOTIFY_RETRY_DELAY = 5
+NOTIFY_MAX_ATTEMPTS = 5
+
+# Сколько сообщений рассылки отправляется одновременно; общий темп задает AIORateLimiter приложения,
+# темп на чат - send_limiter
+BROADCAST_CONCURRENCY = 30
+
+async def _send_admin_message(bot: Bot, admin_id: int, text: str,
+                              reply_markup: Optional[InlineKeyboardMarkup] = None,
+                              parse_mode: str = ParseMode.MARKDOWN) -> None:
+    """Отправить сообщение одному админу с учетом лимитов Telegram"""
+    async with send_limiter.slot(admin_id):
+        await bot.send_message(
+            chat_id=admin_id,
+            text=text,
+            reply_markup=reply_markup,
+            parse_mode=parse_mode
+        )
+
+async def notify_admins(bot: Bot, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None,
+                        admin_ids: Iterable[int] = ADMIN_IDS,
+                        parse_mode: str = ParseMode.MARKDOWN) -> List[int]:
+    """Разослать сообщение админам параллельно
+
+    Ошибки отдельных отправок только логируются; возвращает ID админов, которым отправить не удалось.
+    """
+    admin_ids = list(admin_ids)
+    results = await asyncio.gather(
+        *(_send_admin_message(bot, admin_id, text, reply_markup, parse_mode) for admin_id in admin_ids),
+        return_exceptions=True
+    )
+    failed = []
+    for admin_id, result in zip(admin_ids, results):
+        if isinstance(result, Exception):
+            logger.error("Failed to notify admin %s: %s", admin_id, result)
+            failed.append(admin_id)
+    return failed
+
+async def fanout(chat_ids: Iterable[int], send: Callable[[int], Awaitable[Any]],
+                 concurrency: int = BROADCAST_CONCURRENCY) -> List[int]:
+    """Вызвать send(chat_id) для всех чатов, не больше concurrency одновременно
+
+    Ошибки отдельных отправок не прерывают остальные; возвращает ID чатов, отправка в которые не удалась.
+    """
+    chat_ids = list(chat_ids)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send_one(chat_id: int) -> None:
+        async with semaphore:
+            await send(chat_id)
+
+    results = await asyncio.gather(*(send_one(chat_id) for chat_id in chat_ids), return_exceptions=True)
+    return [chat_id for chat_id, result in zip(chat_ids, results) if isinstance(result, Exception)]
+
+def schedule_admin_notification(job_queue: JobQueue, text: str,
+                                reply_markup: Optional[InlineKeyboardMarkup] = None) -> None:
+    """Поставить уведомление админам в JobQueue, не задерживая текущий обработчик"""
+    data = {'text': text, 'reply_markup': reply_markup, 'admin_ids': list(ADMIN_IDS), 'attempt': 1}
+    job_queue.run_once(_notify_admins_job, when=0, data=data)
+
+async def _notify_admins_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Отправка уведомления; админам, до которых оно не дошло, отправка повторяется с растущей паузой"""
+    data = context.job.data
+    failed = await notify_admins(context.bot, data['text'], data['reply_markup'], data['admin_ids'])
+    if not failed:
+        return
+
+    if data['attempt'] >= NOTIFY_MAX_ATTEMPTS:
+        logger.error("Giving up notifying admins %s after %s attempts", failed, data['attempt'])
+        return
+
+    delay = NOTIFY_RETRY_DELAY * 2 ** (data['attempt'] - 1)
+    context.job_queue.run_once(
+        _notify_admins_job,
+        when=delay,
+        data={**data, 'admin_ids': failed, 'attempt': data['attempt'] + 1}
+    )
@@ -0,0 +1,86 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+try:
+    from redis import asyncio as redis_asyncio
+except ImportError:  # redis необязателен: без него используются только локальные кэши
+    redis_asyncio = None
+
+logger = logging.getLogger(__name__)
+
+class TTLCache:
+    """Небольшой LRU-кэш с временем жизни записей
+
+    При переполнении вытесняется запись, к которой дольше всего не обращались;
+    просроченные записи удаляются при чтении.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: 'OrderedDict[Hashable, tuple[float, Any]]' = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Значение по ключу или default, если записи нет или она просрочена"""
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Сохранить значение; ttl переопределяет время жизни по умолчанию"""
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Удалить запись и вернуть ее значение"""
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self) -> None:
+        """Очистить кэш"""
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+class SharedFlagCache:
+    """Общий для процессов кэш булевых флагов в Redis
+
+    Если REDIS_URL не задан или пакет redis не установлен, кэш отключен:
+    get всегда возвращает None, set ничего не делает. Ошибки Redis
+    только логируются - источником истины остается запрос, результат которого кэшируется.
+    """
+
+    def __init__(self, url: Optional[str], prefix: str):
+        self.prefix = prefix
+        self._redis = redis_asyncio.from_url(url) if url and redis_asyncio else None
+
+    async def get(self, key: Hashable) -> Optional[bool]:
+        """Флаг по ключу или None, если его нет"""
+        if self._redis is None:
+            return None
+        try:
+            value = await self._redis.get(f"{self.prefix}:{key}")
+        except Exception as e:
+            logger.warning("Redis get failed: %s", e)
+            return None
+        return None if value is None else value == b'1'
+
+    async def set(self, key: Hashable, value: bool, ttl: float) -> None:
+        """Сохранить флаг на ttl секунд"""
+        if self._redis is None:
+            return
+        try:
+            await self._redis.set(f"{self.prefix}:{key}", b'1' if value else b'0', ex=max(int(ttl), 1))
+        except Exception as e:
+            logger.warning("Redis set failed: %s", e)
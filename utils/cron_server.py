@@ -18,39 +18,53 @@ class CronServer:
         self.interval = interval
         self.is_running = False
         self._task: Optional[asyncio.Task] = None
+        # Одна сессия на все пинги: соединение (и TLS) переиспользуется, а не открывается заново
+        self._session: Optional[aiohttp.ClientSession] = None
         
     async def ping(self) -> bool:
         """Отправка пинга на URL приложения"""
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(self.app_url) as response:
-                    if response.status == 200:
-                        logger.info(f"[{datetime.now()}] Успешный пинг")
-                        return True
-                    else:
-                        logger.warning(f"[{datetime.now()}] Пинг вернул статус {response.status}")
-                        return False
+            if self._session is None or self._session.closed:
+                self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+            async with self._session.get(self.app_url) as response:
+                if response.status == 200:
+                    logger.info("[%s] Успешный пинг", datetime.now())
+                    return True
+                else:
+                    logger.warning("[%s] Пинг вернул статус %s", datetime.now(), response.status)
+                    return False
         except Exception as e:
-            logger.error(f"[{datetime.now()}] Ошибка при пинге: {str(e)}")
+            logger.error("[%s] Ошибка при пинге: %s", datetime.now(), e)
             return False
 
     async def _ping_loop(self):
         """Основной цикл пингов"""
-        while self.is_running:
-            await self.ping()
-            await asyncio.sleep(self.interval)
+        try:
+            while self.is_running:
+                await self.ping()
+                await asyncio.sleep(self.interval)
+        finally:
+            if self._session is not None:
+                await self._session.close()
+                self._session = None
 
-    def start(self):
-        """Запуск сервера пингов"""
+    async def start(self) -> asyncio.Task:
+        """Запуск сервера пингов в текущем цикле событий; возвращает задачу цикла пингов"""
         if not self.is_running:
             self.is_running = True
-            self._task = asyncio.create_task(self._ping_loop())
+            self._task = asyncio.get_running_loop().create_task(self._ping_loop())
             logger.info("Сервер пингов запущен")
+        return self._task
 
-    def stop(self):
-        """Остановка сервера пингов"""
+    async def stop(self):
+        """Остановка сервера пингов: задача отменяется и дожидается закрытия сессии"""
         if self.is_running:
             self.is_running = False
             if self._task:
                 self._task.cancel()
+                try:
+                    await self._task
+                except asyncio.CancelledError:
+                    pass
+                self._task = None
             logger.info("Сервер пингов остановлен")
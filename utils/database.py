@@ -1,16 +1,40 @@
 import os
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Optional, Dict, AsyncGenerator
-from sqlalchemy import create_engine, func
+from typing import Any, Callable, Iterator, List, Optional, Dict, AsyncGenerator
+from sqlalchemy import case, create_engine, event, func, update
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.exc import SQLAlchemyError
-from config import DATABASE_URL, DATABASE_BACKUP_DIR
+from config import DATABASE_URL, DATABASE_BACKUP_DIR, DATABASE_POOL_SIZE
 from models.user import Base, User, Referral, Investment, WithdrawalRequest
+from utils.cache import TTLCache
 from contextlib import asynccontextmanager
 
 logger = logging.getLogger(__name__)
 
+def _set_sqlite_pragmas(dbapi_connection: Any, connection_record: Any) -> None:
+    """Настройки SQLite для каждого нового соединения пула
+
+    WAL позволяет читать, пока другой поток пишет, а synchronous=NORMAL в режиме WAL
+    не делает fsync на каждый коммит. busy_timeout заставляет ждать блокировку записи
+    вместо немедленной ошибки "database is locked".
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+# Индексы, добавленные в модели после появления таблиц. create_all не создает индексы
+# для уже существующих таблиц, поэтому init_db создает их отдельно, если их еще нет
+_ADDED_INDEXES = (
+    'ix_withdrawal_requests_user_id_date',
+    'ix_users_total_earned_balance',
+    'ix_withdrawal_requests_status',
+)
+
 class Database:
     _instance = None
 
@@ -22,19 +46,101 @@ class Database:
 
     def _initialize(self):
         """Инициализация подключения к базе данных"""
-        self.engine = create_engine(DATABASE_URL)
+        self.engine = create_engine(DATABASE_URL, pool_size=DATABASE_POOL_SIZE)
+        if self.engine.dialect.name == 'sqlite':
+            event.listen(self.engine, 'connect', _set_sqlite_pragmas)
         self.SessionLocal = sessionmaker(bind=self.engine)
-        self.session = self.SessionLocal()
+        # Загруженные объекты не истекают после коммита и переиспользуются в пределах обновления;
+        # изменения из других сессий помечаются устаревшими точечно через expire()
+        self.session = self.SessionLocal(expire_on_commit=False)
+        # Пользователи по Telegram ID: большинство обновлений читает одну и ту же строку
+        self._user_cache = TTLCache(maxsize=10_000, ttl=60)
+        # Потоков не больше, чем соединений в пуле, чтобы запросы не ждали соединение внутри потока
+        self.executor = ThreadPoolExecutor(max_workers=DATABASE_POOL_SIZE, thread_name_prefix='db')
         
         # Создаем все таблицы
-        Base.metadata.create_all(self.engine)
+        self.init_db()
         
         # Создаем директорию для бэкапов
         os.makedirs(DATABASE_BACKUP_DIR, exist_ok=True)
 
+    def init_db(self):
+        """Создать недостающие таблицы и индексы"""
+        Base.metadata.create_all(self.engine)
+        indexes = {index.name: index for table in Base.metadata.sorted_tables for index in table.indexes}
+        for name in _ADDED_INDEXES:
+            indexes[name].create(self.engine, checkfirst=True)
+
+    async def run_in_session(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Выполнить func(session, *args) в пуле потоков БД, не блокируя цикл событий
+
+        У каждого вызова своя сессия: общая self.session принадлежит потоку цикла событий.
+        При успехе транзакция фиксируется, при ошибке откатывается и исключение пробрасывается.
+        Объекты, возвращенные из func, не истекают после коммита и доступны только для чтения.
+        Строки, измененные func, вызывающий код помечает устаревшими в общей сессии через expire.
+        """
+        def call() -> Any:
+            session = self.SessionLocal(expire_on_commit=False)
+            try:
+                result = func(session, *args)
+                session.commit()
+                return result
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+    def expire(self, model: type, *pks: Optional[int]) -> None:
+        """Пометить устаревшими строки model, измененные в другой сессии
+
+        Истекают только эти объекты, если они загружены в общую сессию: при следующем
+        обращении перечитывается одна строка, а не все закэшированные пользователи.
+        """
+        for pk in pks:
+            if pk is None:
+                continue
+            obj = self.session.identity_map.get(self.session.identity_key(model, pk))
+            if obj is not None:
+                self.session.expire(obj)
+
     def get_user(self, user_id: int) -> Optional[User]:
-        """Получить пользователя по ID"""
-        return self.session.query(User).filter(User.user_id == user_id).first()
+        """Получить пользователя по ID
+
+        Найденный пользователь кэшируется на минуту. Объект остается привязан к общей
+        сессии; после записи через run_in_session вызывающий код помечает его устаревшим
+        через expire, и он перечитает поля при следующем обращении.
+        """
+        user = self._user_cache.get(user_id)
+        if user is None:
+            user = self.session.query(User).filter(User.user_id == user_id).first()
+            if user is not None:
+                self._user_cache.set(user_id, user)
+        return user
+
+    def invalidate_user(self, user_id: int) -> None:
+        """Убрать пользователя из кэша после изменения"""
+        self._user_cache.pop(user_id)
+
+    def set_user_blocked(self, user_id: int, blocked: bool) -> bool:
+        """Заблокировать или разблокировать пользователя"""
+        user = self.get_user(user_id)
+        if not user:
+            return False
+        user.is_blocked = blocked
+        self.session.commit()
+        self.invalidate_user(user_id)
+        return True
+
+    def block_user(self, user_id: int) -> bool:
+        """Заблокировать пользователя"""
+        return self.set_user_blocked(user_id, True)
+
+    def unblock_user(self, user_id: int) -> bool:
+        """Разблокировать пользователя"""
+        return self.set_user_blocked(user_id, False)
 
     def create_user(self, user_id: int) -> User:
         """Создать нового пользователя"""
@@ -48,7 +154,7 @@ class Database:
         referrer = self.get_user(referrer_id)
         referred = self.get_user(referred_id)
         if not referrer or not referred:
-            logger.warning(f"Не удалось получить реферал: referrer={referrer_id}, referred={referred_id}")
+            logger.warning("Не удалось получить реферал: referrer=%s, referred=%s", referrer_id, referred_id)
             return None
         return self.session.query(Referral)\
             .filter(Referral.referrer_id == referrer.id, Referral.referred_id == referred.id)\
@@ -58,7 +164,7 @@ class Database:
         """Получить список рефералов пользователя"""
         user = self.get_user(user_id)
         if not user:
-            logger.warning(f"Пользователь не найден при запросе рефералов: user_id={user_id}")
+            logger.warning("Пользователь не найден при запросе рефералов: user_id=%s", user_id)
             return []
         return user.referrals
 
@@ -67,7 +173,7 @@ class Database:
         referrer = self.get_user(referrer_id)
         referred = self.get_user(referred_id)
         if not referrer or not referred:
-            logger.warning(f"Не удалось создать реферал: referrer={referrer_id}, referred={referred_id}")
+            logger.warning("Не удалось создать реферал: referrer=%s, referred=%s", referrer_id, referred_id)
             return None
         referral = Referral(
             referrer_id=referrer.id,
@@ -79,14 +185,12 @@ class Database:
         return referral
 
     def get_user_statistics(self) -> Dict:
-        """Получить статистику пользователей"""
-        total_users = self.session.query(func.count(User.id)).scalar()
-        active_users = self.session.query(func.count(User.id))\
-            .filter(User.channel_joined == True)\
-            .scalar()
-        blocked_users = self.session.query(func.count(User.id))\
-            .filter(User.is_blocked == True)\
-            .scalar()
+        """Получить статистику пользователей (один агрегирующий запрос)"""
+        total_users, active_users, blocked_users = self.session.query(
+            func.count(User.id),
+            func.count(case((User.channel_joined == True, 1))),
+            func.count(case((User.is_blocked == True, 1)))
+        ).one()
             
         return {
             'total_users': total_users,
@@ -98,11 +202,30 @@ class Database:
         """Получить всех пользователей"""
         return self.session.query(User).all()
 
+    def iter_user_id_batches(self, batch_size: int = 1000) -> Iterator[List[int]]:
+        """Перебрать Telegram ID всех пользователей пачками по batch_size
+
+        Каждая пачка - отдельный запрос по ключу (user_id > последнего), поэтому
+        в памяти не больше одной пачки и между пачками не остается открытого курсора.
+        """
+        last_id = None
+        while True:
+            query = self.session.query(User.user_id)
+            if last_id is not None:
+                query = query.filter(User.user_id > last_id)
+            batch = [row[0] for row in query.order_by(User.user_id).limit(batch_size)]
+            if not batch:
+                return
+            yield batch
+            last_id = batch[-1]
+
     def get_investments_statistics(self) -> Dict:
-        """Получить статистику инвестиций"""
-        total_investments = self.session.query(func.sum(Investment.amount)).scalar() or 0
-        total_profit_paid = self.session.query(func.sum(Investment.total_profit)).scalar() or 0
-        active_investments = self.session.query(func.count(Investment.id)).scalar()
+        """Получить статистику инвестиций (один агрегирующий запрос)"""
+        total_investments, total_profit_paid, active_investments = self.session.query(
+            func.coalesce(func.sum(Investment.amount), 0),
+            func.coalesce(func.sum(Investment.current_profit), 0),
+            func.count(case((Investment.is_finished == False, 1)))
+        ).one()
             
         return {
             'total_investments': total_investments,
@@ -117,15 +240,26 @@ class Database:
             backup_path = os.path.join(DATABASE_BACKUP_DIR, f'backup_{timestamp}.sql')
             
             # TODO: Implement actual database backup logic
-            logger.info(f"База данных успешно сохранена в {backup_path}")
+            logger.info("База данных успешно сохранена в %s", backup_path)
         except Exception as e:
-            logger.error(f"Ошибка при создании резервной копии: {e}")
+            logger.error("Ошибка при создании резервной копии: %s", e)
 
     def create_withdrawal_request(self, user_id: int, amount: float, method: str, details: str) -> Optional[WithdrawalRequest]:
         """Создать заявку на вывод средств"""
         user = self.get_user(user_id)
         if not user:
-            logger.warning(f"Не удалось создать заявку на вывод: user_id={user_id} не найден")
+            logger.warning("Не удалось создать заявку на вывод: user_id=%s не найден", user_id)
+            return None
+        # Условный UPDATE: списание не пройдет, если баланса уже не хватает
+        # (например, средства успела списать другая заявка)
+        debited = self.session.execute(
+            update(User)
+            .where(User.id == user.id, User.balance >= amount)
+            .values(balance=User.balance - amount)
+        ).rowcount
+        if not debited:
+            self.session.rollback()
+            logger.warning("Недостаточно средств для заявки на вывод: user_id=%s, amount=%s", user_id, amount)
             return None
         withdrawal = WithdrawalRequest(
             user_id=user.id,
@@ -135,7 +269,6 @@ class Database:
             date=datetime.now(),
             status='pending'
         )
-        user.balance -= amount
         self.session.add(withdrawal)
         self.session.commit()
         return withdrawal
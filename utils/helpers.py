@@ -1,6 +1,10 @@
 from datetime import datetime
-from typing import Union
+from typing import Dict, Tuple, Union
 import re
+import time
+
+# Последняя отформатированная секунда для каждого формата: {fmt: (секунда, строка)}
+_now_str_cache: Dict[str, Tuple[int, str]] = {}
 
 def format_currency(amount: Union[int, float]) -> str:
     """Форматирование суммы в красивый вид"""
@@ -10,6 +14,16 @@ def format_datetime(dt: datetime) -> str:
     """Форматирование даты и времени"""
     return dt.strftime("%d.%m.%Y %H:%M")
 
+def format_now(fmt: str = "%d.%m.%Y %H:%M:%S") -> str:
+    """Текущее время строкой; strftime вызывается не чаще раза в секунду для каждого формата"""
+    second = int(time.time())
+    cached = _now_str_cache.get(fmt)
+    if cached and cached[0] == second:
+        return cached[1]
+    text = datetime.fromtimestamp(second).strftime(fmt)
+    _now_str_cache[fmt] = (second, text)
+    return text
+
 def validate_amount(amount_str: str) -> tuple[bool, float, str]:
     """Проверка корректности суммы"""
     try:
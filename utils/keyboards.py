@@ -1,9 +1,13 @@
+from functools import lru_cache
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from typing import List, Optional
 from config import CHANNEL_LINK, CHANNEL_NAME, MIN_WITHDRAW, INVESTMENT_PLANS
 
 class Keyboards:
+    """Клавиатуры обработчиков"""
+
     @staticmethod
+    @lru_cache(maxsize=2)
     def main_menu(is_admin: bool = False) -> InlineKeyboardMarkup:
         """Главное меню бота"""
         keyboard = [
@@ -31,6 +35,7 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
 
     @staticmethod
+    @lru_cache(maxsize=1)
     def admin_panel() -> InlineKeyboardMarkup:
         """Клавиатура админ-панели"""
         keyboard = [
@@ -51,6 +56,7 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
 
     @staticmethod
+    @lru_cache(maxsize=1)
     def channel_check() -> InlineKeyboardMarkup:
         """Клавиатура проверки подписки на канал"""
         keyboard = [
@@ -60,6 +66,7 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
 
     @staticmethod
+    @lru_cache(maxsize=1)
     def investment_menu() -> InlineKeyboardMarkup:
         """Меню инвестиций"""
         keyboard = []
@@ -99,6 +106,7 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
 
     @staticmethod
+    @lru_cache(maxsize=256)
     def payment_methods(amount: float) -> InlineKeyboardMarkup:
         """Выбор способа оплаты"""
         keyboard = [
@@ -110,6 +118,7 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
 
     @staticmethod
+    @lru_cache(maxsize=1)
     def back_to_menu() -> InlineKeyboardMarkup:
         """Кнопка возврата в главное меню"""
         return InlineKeyboardMarkup([[
@@ -125,6 +134,7 @@ class Keyboards:
         ]])
 
     @staticmethod
+    @lru_cache(maxsize=1)
     def back_to_admin() -> InlineKeyboardMarkup:
         """Кнопка возврата в админ-панель"""
         return InlineKeyboardMarkup([[
@@ -132,6 +142,7 @@ class Keyboards:
         ]])
 
     @staticmethod
+    @lru_cache(maxsize=32)
     def cancel_action(return_to: str) -> InlineKeyboardMarkup:
         """Кнопка отмены действия"""
         return InlineKeyboardMarkup([[
@@ -3,13 +3,27 @@ import logging
 from datetime import datetime
 from config import DATA_FILE, BLOCKED_USERS_FILE
 from models.user import User, Base
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, insert
 from sqlalchemy.orm import sessionmaker
 
+try:
+    import orjson
+except ImportError:  # orjson необязателен: без него файлы разбираются стандартным json
+    orjson = None
+
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def _load_json(path: str):
+    """Прочитать JSON-файл целиком и разобрать его (orjson, если установлен)
+
+    orjson.JSONDecodeError наследует json.JSONDecodeError, поэтому обработка ошибок одинакова.
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
 def migrate_data():
     """Миграция данных из JSON файлов в SQLite"""
     try:
@@ -24,9 +38,8 @@ def migrate_data():
 
         # Загрузка данных пользователей
         try:
-            with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                users_data = {int(k): v for k, v in data.items()}
+            data = _load_json(DATA_FILE)
+            users_data = {int(k): v for k, v in data.items()}
             logger.info(f"Загружено {len(users_data)} пользователей из JSON")
         except FileNotFoundError:
             logger.warning("Файл с данными пользователей не найден")
@@ -35,31 +48,34 @@ def migrate_data():
 
         # Загрузка списка заблокированных пользователей
         try:
-            with open(BLOCKED_USERS_FILE, 'r', encoding='utf-8') as f:
-                blocked_users = set(json.load(f))
+            blocked_users = set(_load_json(BLOCKED_USERS_FILE))
             logger.info(f"Загружено {len(blocked_users)} заблокированных пользователей")
         except FileNotFoundError:
             logger.warning("Файл заблокированных пользователей не найден")
         except json.JSONDecodeError:
             logger.error("Ошибка при чтении файла блокировок")
 
-        # Миграция данных
+        # Миграция данных: строки собираются в список и вставляются одним executemany,
+        # а не отдельным объектом и строкой лога на каждого пользователя
+        rows = []
         for user_id, user_data in users_data.items():
             try:
-                user = User(
-                    user_id=user_id,
-                    balance=float(user_data.get('balance', 0)),
-                    total_earned=float(user_data.get('total_earned', 0)),
-                    withdrawals=float(user_data.get('withdrawals', 0)),
-                    last_bonus=datetime.fromisoformat(user_data.get('last_bonus', datetime.min.isoformat())),
-                    join_date=datetime.fromisoformat(user_data.get('join_date', datetime.now().isoformat())),
-                    channel_joined=bool(user_data.get('channel_joined', False)),
-                    is_blocked=user_id in blocked_users
-                )
-                session.add(user)
-                logger.info(f"Мигрирован пользователь {user_id}")
+                rows.append({
+                    'user_id': user_id,
+                    'balance': float(user_data.get('balance', 0)),
+                    'total_earned': float(user_data.get('total_earned', 0)),
+                    'withdrawals': float(user_data.get('withdrawals', 0)),
+                    'last_bonus': datetime.fromisoformat(user_data.get('last_bonus', datetime.min.isoformat())),
+                    'join_date': datetime.fromisoformat(user_data.get('join_date', datetime.now().isoformat())),
+                    'channel_joined': bool(user_data.get('channel_joined', False)),
+                    'is_blocked': user_id in blocked_users
+                })
             except Exception as e:
-                logger.error(f"Ошибка миграции пользователя {user_id}: {e}")
+                logger.error("Ошибка миграции пользователя %s: %s", user_id, e)
+
+        if rows:
+            session.execute(insert(User), rows)
+        logger.info("Мигрировано пользователей: %s", len(rows))
 
         # Сохраняем изменения
         session.commit()
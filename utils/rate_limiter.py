@@ -0,0 +1,142 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Coroutine, Dict, Optional
+
+from telegram.error import RetryAfter
+from telegram.ext import AIORateLimiter
+
+class TokenBucket:
+    """Асинхронный token bucket: не более rate запросов в секунду с запасом max_tokens"""
+
+    def __init__(self, rate: float, max_tokens: float):
+        self.rate = rate
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        """Пополнить токены за прошедшее время"""
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    async def acquire(self) -> None:
+        """Дождаться и забрать один токен"""
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+    async def __aenter__(self) -> 'TokenBucket':
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info) -> bool:
+        return False
+
+class SendRateLimiter:
+    """Ограничитель исходящих сообщений под лимит Telegram ~1 msg/s в чат
+
+    Общий лимит ~30 запросов/с соблюдает AIORateLimiter приложения для всех запросов
+    к Bot API, поэтому здесь он повторно не применяется.
+    """
+
+    # Сколько корзин чатов держим до очистки простаивающих
+    MAX_CHAT_BUCKETS = 10_000
+
+    def __init__(self, per_chat_rate: float = 1):
+        self.per_chat_rate = per_chat_rate
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        """Корзина конкретного чата"""
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self.MAX_CHAT_BUCKETS:
+                self._drop_idle_buckets()
+            bucket = TokenBucket(self.per_chat_rate, 1)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _drop_idle_buckets(self) -> None:
+        """Удалить корзины чатов, которые уже полностью восстановились"""
+        now = time.monotonic()
+        idle_after = 1 / self.per_chat_rate
+        for chat_id, bucket in list(self._chat_buckets.items()):
+            if now - bucket.last_refill >= idle_after:
+                del self._chat_buckets[chat_id]
+
+    @asynccontextmanager
+    async def slot(self, chat_id: int) -> AsyncIterator[None]:
+        """Дождаться разрешения на отправку сообщения в чат"""
+        await self._chat_bucket(chat_id).acquire()
+        yield
+
+class AIMDConcurrency:
+    """Адаптивный лимит одновременных запросов (AIMD)
+
+    Каждый успешный запрос увеличивает лимит на increase (до maximum),
+    ответ 429 уменьшает его в decrease раз (до minimum). Прочие ошибки (таймауты,
+    сетевые сбои, BadRequest) лимит не меняют.
+    """
+
+    def __init__(self, initial: float = 8, minimum: float = 1, maximum: float = 32,
+                 increase: float = 0.5, decrease: float = 0.5):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Дождаться свободного места в пределах текущего лимита"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+        # None - запрос завершился другой ошибкой, лимит не меняется
+        succeeded: Optional[bool] = None
+        try:
+            yield
+            succeeded = True
+        except RetryAfter:
+            succeeded = False
+            raise
+        finally:
+            async with self._condition:
+                self.in_flight -= 1
+                if succeeded:
+                    self.limit = min(self.maximum, self.limit + self.increase)
+                elif succeeded is False:
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                self._condition.notify_all()
+
+class AIMDRateLimiter(AIORateLimiter):
+    """AIORateLimiter с адаптивным числом одновременных запросов к Bot API
+
+    Лимиты по частоте (30 запросов/с всего, 20/мин в группу) и повторы после
+    RetryAfter остаются за AIORateLimiter; каждая попытка дополнительно занимает место в AIMDConcurrency.
+    """
+
+    def __init__(self, *args: Any, concurrency: Optional[AIMDConcurrency] = None, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.concurrency = concurrency or AIMDConcurrency()
+
+    async def process_request(self, callback: Callable[..., Coroutine[Any, Any, Any]], args: Any,
+                              kwargs: Dict[str, Any], endpoint: str, data: Dict[str, Any],
+                              rate_limit_args: Optional[int]) -> Any:
+        async def limited_callback(*cb_args: Any, **cb_kwargs: Any) -> Any:
+            async with self.concurrency.slot():
+                return await callback(*cb_args, **cb_kwargs)
+
+        return await super().process_request(limited_callback, args, kwargs, endpoint, data, rate_limit_args)
+
+# Общий ограничитель для всего процесса
+send_limiter = SendRateLimiter()